@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from urllib.parse import quote
+from config import (
+    ARCHIVE_DIR, ARCHIVE_AFTER_S, ARCHIVE_INTERVAL_S,
+    ARCHIVE_RETENTION_DAYS, ARCHIVE_CHUNK_ROWS,
+)
+
+# ==============================
+# Arquivamento de sessões em Parquet
+# ==============================
+# Sessões encerradas (sem dados há ARCHIVE_AFTER_S) são exportadas para
+# ARCHIVE_DIR/<sessão>.parquet (zstd) e removidas do SQLite em blocos pequenos,
+# para não segurar o lock de escrita enquanto pilotos enviam voltas.
+# O catálogo guarda `archived_max_id`: linhas com id <= esse valor estão no
+# Parquet, as demais (se a sessão voltar a receber dados) continuam no SQLite.
+#
+# pyarrow é opcional: sem ele o arquivamento fica desativado.
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pc = pq = None
+
+
+def archive_available():
+    return pq is not None
+
+
+def archive_path(session_id):
+    return ARCHIVE_DIR / f"{quote(session_id, safe='')}.parquet"
+
+
+def row_type(names):
+    """Classe de linha com a mesma interface de sqlite3.Row (r['col'], r[0], dict(r))."""
+    index = {name: i for i, name in enumerate(names)}
+
+    class ArchivedRow(tuple):
+        __slots__ = ()
+
+        def __getitem__(self, key):
+            if isinstance(key, str):
+                key = index[key]
+            return tuple.__getitem__(self, key)
+
+        def keys(self):
+            return list(names)
+
+    return ArchivedRow
+
+
+def read_rows(session_id, names, since_id=0, max_id=None, limit=None, tail=False, received=None,
+              where=()):
+    """Linhas arquivadas com since_id < id <= max_id, alinhadas às colunas `names`
+    (colunas criadas depois do arquivamento vêm como None). `received=(from_ms, to_ms)`
+    filtra por received_ms; arquivos anteriores a essa coluna não têm linhas na janela.
+    `where`: filtros extras no formato do pyarrow, ex: [('driver', '==', 'Ana')]."""
+    path = archive_path(session_id)
+    if pq is None or not path.exists():
+        return []
+    filters = [('id', '>', since_id), *where]
+    if max_id is not None:
+        filters.append(('id', '<=', max_id))
+    if received is not None and any(v is not None for v in received):
+        if 'received_ms' not in pq.read_schema(path).names:
+            return []
+        for op, value in zip(('>=', '<='), received):
+            if value is not None:
+                filters.append(('received_ms', op, value))
+    table = pq.read_table(path, filters=filters)
+    if limit is not None:
+        table = table.slice(max(0, table.num_rows - limit)) if tail else table.slice(0, limit)
+    columns = [
+        table.column(name).to_pylist() if name in table.column_names else [None] * table.num_rows
+        for name in names
+    ]
+    Row = row_type(names)
+    return [Row(values) for values in zip(*columns)]
+
+
+def iter_rows(session_id, max_id=None, chunk_rows=ARCHIVE_CHUNK_ROWS, received=None):
+    """Gera (colunas, linhas) das linhas arquivadas com id <= max_id, em ordem de
+    id, lendo um record batch de até `chunk_rows` por vez: a memória fica limitada a
+    um bloco (read_rows carrega o trecho filtrado inteiro). Usado na exportação."""
+    path = archive_path(session_id)
+    if pq is None or not path.exists():
+        return
+    parquet = pq.ParquetFile(path)
+    window = [
+        (op, value) for op, value in zip((pc.greater_equal, pc.less_equal), received or ())
+        if value is not None
+    ]
+    if window and 'received_ms' not in parquet.schema_arrow.names:
+        return
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        ids = batch.column('id')
+        done = max_id is not None and pc.max(ids).as_py() > max_id
+        conditions = [(pc.less_equal, 'id', max_id)] if done else []
+        conditions += [(op, 'received_ms', value) for op, value in window]
+        for op, name, value in conditions:
+            batch = batch.filter(op(batch.column(name), value))
+        if batch.num_rows:
+            names = batch.schema.names
+            Row = row_type(names)
+            yield names, [Row(values) for values in zip(*(c.to_pylist() for c in batch.columns))]
+        if done:
+            break    # o arquivo está em ordem de id: nada depois disso entra
+
+
+def export_session(db, session_id, chunk_rows=ARCHIVE_CHUNK_ROWS):
+    """Grava as linhas da sessão (mais as já arquivadas) num Parquet novo, em blocos.
+
+    Retorna o maior id exportado (0 se não havia nada). O arquivo é escrito num
+    temporário e trocado atomicamente, então leitores nunca veem um Parquet parcial.
+    """
+    path = archive_path(session_id)
+    tmp = path.with_suffix('.parquet.tmp')
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    names = [c[1] for c in db.execute('PRAGMA table_info(telemetry)')]
+    writer, max_id = None, 0
+    try:
+        def write(table):
+            nonlocal writer
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, table.schema, compression='zstd')
+            writer.write_table(table.cast(writer.schema))
+
+        if path.exists():
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+                old = pa.Table.from_batches([batch])
+                write(pa.table({
+                    n: old.column(n) if n in old.column_names else pa.nulls(old.num_rows)
+                    for n in names
+                }))
+                max_id = max(max_id, max(old.column('id').to_pylist(), default=0))
+
+        cursor = max_id
+        while True:
+            rows = db.execute(
+                'SELECT * FROM telemetry WHERE session_id=? AND id>? ORDER BY id LIMIT ?',
+                (session_id, cursor, chunk_rows)
+            ).fetchall()
+            if not rows:
+                break
+            write(pa.table({n: list(col) for n, col in zip(names, zip(*rows))}))
+            cursor = max_id = rows[-1]['id']
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        return 0
+    os.replace(tmp, path)
+    return max_id
+
+
+def delete_rows(db, session_id, max_id=None, chunk_rows=ARCHIVE_CHUNK_ROWS):
+    """Apaga as linhas da sessão em blocos (uma transação curta por bloco)."""
+    if max_id is None:
+        max_id = (1 << 63) - 1
+    deleted = 0
+    while True:
+        with db:
+            n = db.execute(
+                'DELETE FROM telemetry WHERE id IN '
+                '(SELECT id FROM telemetry WHERE session_id=? AND id<=? ORDER BY id LIMIT ?)',
+                (session_id, max_id, chunk_rows)
+            ).rowcount
+        deleted += n
+        if n < chunk_rows:
+            return deleted
+        time.sleep(0)   # cede a vez para o writer entre os blocos
+
+
+def reclaim_space(db):
+    """Devolve páginas livres ao sistema de arquivos e trunca o WAL."""
+    # executescript roda o pragma até o fim; execute() só libera uma página por chamada.
+    db.executescript('PRAGMA incremental_vacuum;')
+    db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+
+class Archiver:
+    """Thread que arquiva sessões encerradas e aplica a retenção dos Parquet."""
+
+    def __init__(self, archive_fn, expire_fn, get_db):
+        self._archive_fn = archive_fn      # archive_fn(session_id)
+        self._expire_fn = expire_fn        # expire_fn(session_id): retenção vencida
+        self._get_db = get_db
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if pq is None:
+            print("🗄️ pyarrow não instalado: arquivamento de sessões desativado.")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='session-archiver', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self):
+        db = self._get_db()
+        now = time.time()
+        finished = [r[0] for r in db.execute(
+            'SELECT session_id FROM sessions WHERE last_seen < ? '
+            'AND row_count > 0 AND archived_max_id < max_id',
+            (now - ARCHIVE_AFTER_S,)
+        )]
+        for session_id in finished:
+            if self._stop.is_set():
+                return
+            self._archive_fn(session_id)
+        expired = [r[0] for r in db.execute(
+            'SELECT session_id FROM sessions WHERE archived_max_id > 0 AND last_seen < ?',
+            (now - ARCHIVE_RETENTION_DAYS * 86400,)
+        )]
+        for session_id in expired:
+            self._expire_fn(session_id)
+        if finished or expired:
+            reclaim_space(db)
+
+    def _run(self):
+        while not self._stop.wait(ARCHIVE_INTERVAL_S):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️ Erro no arquivamento: {e}")
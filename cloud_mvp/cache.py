@@ -0,0 +1,164 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from config import CACHE_MAX_SESSIONS, CACHE_MAX_ROWS, CACHE_IDLE_S
+
+# ==============================
+# Cache quente das sessões ao vivo
+# ==============================
+# Cada sessão lida recentemente fica em memória: as últimas CACHE_MAX_ROWS linhas
+# (buffer circular; se a sessão couber inteira, é o snapshot completo dela) e os
+# metadados usados no ETag (inclusive a geração da sessão, que muda quando ela é
+# apagada e recriada e os ids recomeçam). O writer só incrementa a versão da sessão após cada
+# commit; o primeiro leitor seguinte busca no banco apenas as linhas novas
+# (id > max_id em cache) e todos os demais leitores são servidos da memória.
+# Sessões ociosas saem por LRU/tempo de inatividade; DELETE descarta a entrada.
+
+
+class _Entry:
+    __slots__ = ('names', 'ids', 'rows', 'complete', 'version',
+                 'row_count', 'last_seen', 'generation', 'last_access', 'lock')
+
+    def __init__(self):
+        self.names = []
+        self.ids = []
+        self.rows = []
+        self.complete = True
+        self.version = -1
+        self.row_count = 0
+        self.last_seen = None
+        self.generation = 0
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def max_id(self):
+        return self.ids[-1] if self.ids else 0
+
+
+class SessionCache:
+    def __init__(self, load_rows, load_meta, max_sessions=CACHE_MAX_SESSIONS,
+                 max_rows=CACHE_MAX_ROWS, idle_s=CACHE_IDLE_S):
+        # load_rows(session_id, since_id, n) → (colunas, últimas n linhas com id > since_id)
+        # load_meta(session_id)              → (row_count, last_seen, geração) do catálogo
+        self._load_rows = load_rows
+        self._load_meta = load_meta
+        self._max_sessions = max_sessions
+        self._max_rows = max_rows
+        self._idle_s = idle_s
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    # ─── Invalidação (chamado pelo writer / DELETE) ─────
+    def on_insert(self, session_ids):
+        with self._lock:
+            for session_id in session_ids:
+                self._versions[session_id] = self._versions.get(session_id, 0) + 1
+
+    def expire_all(self):
+        """Força releitura incremental de todas as sessões (ex: eventos perdidos)."""
+        with self._lock:
+            for session_id in self._entries:
+                self._versions[session_id] = self._versions.get(session_id, 0) + 1
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+            self._versions[session_id] = self._versions.get(session_id, 0) + 1
+
+    # ─── Leitura ────────────────────────────────────────
+    def read(self, session_id, since_id, limit):
+        """Retorna ((max_id, row_count, last_seen, geração), página).
+
+        A página é (colunas, linhas com id > since_id, até `limit`), ou None se o
+        trecho pedido já saiu do buffer — nesse caso o chamador lê do banco.
+        """
+        entry, loaded = self._fresh_entry(session_id)
+        with entry.lock:
+            meta = (entry.max_id, entry.row_count, entry.last_seen, entry.generation)
+            page = None
+            if entry.complete or (entry.ids and since_id >= entry.ids[0]):
+                start = bisect.bisect_right(entry.ids, since_id)
+                page = entry.names, entry.rows[start:start + limit]
+        with self._lock:
+            if page is None or loaded:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return meta, page
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'sessions':  len(self._entries),
+                'rows':      sum(len(e.ids) for e in self._entries.values()),
+                'hits':      self.hits,
+                'misses':    self.misses,
+                'refreshes': self.refreshes,
+                'evictions': self.evictions,
+                'hit_rate':  round(self.hits / total, 4) if total else 0.0,
+            }
+
+    # ─── Internos ───────────────────────────────────────
+    def _fresh_entry(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session_id)
+            version = self._versions.get(session_id, 0)
+            loaded = entry is None
+            if loaded:
+                entry = self._entries[session_id] = _Entry()
+                self._evict(now)
+            else:
+                self._entries.move_to_end(session_id)
+            entry.last_access = now
+
+        with entry.lock:
+            if entry.version != version:
+                self._refresh(session_id, entry, version)
+        return entry, loaded
+
+    def _refresh(self, session_id, entry, version):
+        # Lê a versão antes da consulta: um commit concorrente deixa a entrada
+        # com versão antiga e o próximo leitor busca o que faltou.
+        row_count, last_seen, generation = self._load_meta(session_id)
+        if generation != entry.generation:
+            # Sessão apagada e recriada (ex: evento 'dropped' perdido): os ids
+            # recomeçaram, então o buffer antigo não vale mais.
+            entry.ids, entry.rows, entry.complete = [], [], True
+        names, rows = self._load_rows(session_id, entry.max_id, self._max_rows)
+        entry.row_count, entry.last_seen, entry.generation = row_count, last_seen, generation
+        if entry.version >= 0:
+            with self._lock:
+                self.refreshes += 1
+        entry.names = names
+        if len(rows) >= self._max_rows:
+            # Mais linhas novas do que cabem: o buffer vira só a cauda recém-lida.
+            entry.ids = [r['id'] for r in rows]
+            entry.rows = list(rows)
+            entry.complete = False
+        else:
+            entry.ids.extend(r['id'] for r in rows)
+            entry.rows.extend(rows)
+            overflow = len(entry.ids) - self._max_rows
+            if overflow > 0:
+                del entry.ids[:overflow]
+                del entry.rows[:overflow]
+                entry.complete = False
+        entry.version = version
+
+    def _evict(self, now):
+        # Chamado com self._lock: remove ociosas e depois as menos usadas além do limite.
+        for session_id in [s for s, e in self._entries.items() if now - e.last_access > self._idle_s]:
+            del self._entries[session_id]
+            self.evictions += 1
+        while len(self._entries) > self._max_sessions:
+            self._entries.popitem(last=False)
+            self.evictions += 1
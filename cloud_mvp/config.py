@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 # --- CONFIGURAÇÃO DE DIRETÓRIOS ---
@@ -9,3 +10,78 @@ LOG_DIR.mkdir(parents=True, exist_ok=True)
 REFRESH_RATE_ST = 20
 WINDOW_SIZE = 3
 
+# --- AMOSTRAGEM DO SDK (sampler.py) ---
+SAMPLE_HZ = 60                 # ticks por segundo (no máximo os 60 Hz do iRacing)
+SAMPLE_REPORT_S = 60           # intervalo do log de taxa medida / ticks perdidos
+STATUS_INTERVAL_S = 1.0        # regrava o status.json no máximo a cada N s (ou quando muda)
+
+# --- FECHAMENTO DE VOLTA (lap_closure.py) ---
+LAP_SETTLE_S = 0.5             # CarIdxLap/posição sem mudar por N s → volta fechada...
+LAP_CLOSE_MIN_S = 0.5          # ...mas nunca antes de N s após a detecção...
+LAP_CLOSE_MAX_S = 3.0          # ...e no máximo N s após a detecção
+
+# --- ENVIO PARA A NUVEM (read_iracing_cloud.py / uplink.py) ---
+UPLINK_TIMEOUT_S = 1.0         # timeout de resposta de cada POST
+UPLINK_CONNECT_TIMEOUT_S = 3.0 # timeout para abrir a conexão (TCP+TLS; reaproveitada depois)
+UPLINK_BACKOFF_BASE_S = 1.0    # espera após a 1ª falha; dobra a cada falha seguida...
+UPLINK_BACKOFF_MAX_S = 30.0    # ...até este limite
+UPLINK_BREAKER_FAILURES = 3    # falhas seguidas que abrem o disjuntor (suspende heartbeats)
+UPLINK_BATCH_LAPS = 200        # voltas por POST /telemetry/batch ao esvaziar o spool
+UPLINK_STOP_TIMEOUT_S = 5.0    # no Ctrl+C, tempo para entregar o que ficou na fila
+SPOOL_DIR = LOG_DIR / "uplink_spool"   # journal das voltas ainda não confirmadas (spool.py)
+SPOOL_MAX_BYTES = 50_000_000   # teto do journal; acima disso descarta as voltas mais antigas
+SPOOL_COMPACT_BYTES = 1_000_000  # reescreve o journal quando o trecho já confirmado passa disso
+
+# --- BANCO DE DADOS (server.py) ---
+# Caminho relativo ao diretório de execução do uvicorn (igual ao comportamento antigo).
+DB_PATH = os.getenv("TELEMETRY_DB_PATH", "telemetry.db")
+DB_BUSY_TIMEOUT_MS = 5000      # espera por lock antes de falhar com "database is locked"
+DB_CACHE_SIZE_KB = 16384       # cache de páginas por conexão (16 MB)
+MAX_BATCH_RECORDS = 1000       # limite de registros por POST /telemetry/batch
+MAX_BATCH_BYTES = 8_000_000    # limite do corpo (já descomprimido) de /telemetry/batch
+DB_READ_WORKERS = 8            # threads de leitura (/session, /summary, /sessions...)
+DB_BULK_WORKERS = 2            # threads de operações pesadas (arquivar, apagar, exportar)
+
+# --- ARMAZENAMENTO POR SESSÃO (partitions.py) ---
+# "shared": todas as voltas na tabela telemetry do DB_PATH (padrão).
+# "session": um arquivo SQLite por sessão em PARTITION_DIR; apagar vira remover o arquivo.
+STORAGE_MODE = os.getenv("TELEMETRY_STORAGE_MODE", "shared")
+PARTITION_DIR = Path(os.getenv("TELEMETRY_PARTITION_DIR", "sessions"))
+PARTITION_IDLE_S = 300         # fecha conexões de sessão sem uso há N segundos
+
+# --- GROUP COMMIT (writer.py) ---
+WRITER_MAX_BATCH_ROWS = 500    # fecha o grupo ao atingir N linhas...
+WRITER_MAX_DELAY_MS = 5        # ...ou após N ms esperando mais registros
+WRITER_ACK_TIMEOUT_S = 10      # tempo máximo que uma requisição espera o commit
+
+# --- MULTI-WORKER (writer_service.py) ---
+# "local": o próprio processo do uvicorn grava no SQLite (um único worker).
+# "remote": os workers só leem; gravações vão para o processo escritor em WRITER_ADDRESS.
+WRITER_MODE = os.getenv("TELEMETRY_WRITER_MODE", "local")
+WRITER_ADDRESS = os.getenv("TELEMETRY_WRITER_ADDRESS", "writer.sock")  # socket unix ou host:porta
+# Chave do handshake (as mensagens são pickle: quem tem a chave executa código no
+# escritor). Sem a variável, o escritor gera uma chave aleatória em WRITER_AUTHKEY_FILE
+# (permissão 0600) e os workers a leem de lá.
+WRITER_AUTHKEY = os.getenv("TELEMETRY_WRITER_AUTHKEY", "").encode()
+WRITER_AUTHKEY_FILE = Path(os.getenv("TELEMETRY_WRITER_AUTHKEY_FILE", "writer.key"))
+WRITER_RECONNECT_S = 1.0       # espera entre tentativas de conectar ao processo escritor
+
+# --- STREAM AO VIVO (SSE) ---
+STREAM_KEEPALIVE_S = 15        # comentário SSE periódico para manter túneis/proxies abertos
+
+# --- PAGINAÇÃO DE /session/{id} ---
+SESSION_PAGE_DEFAULT = 2000    # linhas por página quando `limit` não é informado
+SESSION_PAGE_MAX = 5000        # teto rígido, mesmo que o cliente peça mais
+
+# --- CACHE QUENTE DE SESSÕES (cache.py) ---
+CACHE_MAX_SESSIONS = 32        # sessões mantidas em memória (LRU)
+CACHE_MAX_ROWS = 20000         # linhas mais recentes guardadas por sessão
+CACHE_IDLE_S = 1800            # sessão sem leitura há mais que isso sai do cache
+
+# --- ARQUIVAMENTO EM PARQUET (archive.py) ---
+ARCHIVE_DIR = Path(os.getenv("TELEMETRY_ARCHIVE_DIR", "archive"))
+ARCHIVE_AFTER_S = 6 * 3600     # sessão sem dados há 6 h é considerada encerrada
+ARCHIVE_INTERVAL_S = 600       # frequência da varredura de sessões encerradas
+ARCHIVE_RETENTION_DAYS = 30    # Parquet mais antigo que isso é apagado
+ARCHIVE_CHUNK_ROWS = 2000      # linhas por bloco na exportação e no DELETE
+EXPORT_CHUNK_ROWS = 10000      # linhas por row group/record batch em /session/{id}.parquet|.arrow
@@ -1,15 +1,22 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
+import io
 import json
 import os
 import time
 import requests
 from pathlib import Path
-from config import LOG_DIR, REFRESH_RATE_ST
+from urllib.parse import quote
+from config import LOG_DIR, REFRESH_RATE_ST, STREAM_KEEPALIVE_S
 from datetime import datetime
 import pytz
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 # ==============================
 # Configuração da Página
 # ==============================
@@ -41,38 +48,171 @@ def get_status_local():
     except:
         return {"state": "offline", "driver": "---", "track": "---"}
 
-def fetch_cloud_data(url):
-    headers = {
-        'ngrok-skip-browser-warning': 'true',
-        'Bypass-Tunnel-Reminder': 'true',
-        'User-Agent': 'iRacingTelemetryDashboard/1.0'
+CLOUD_HEADERS = {
+    'ngrok-skip-browser-warning': 'true',
+    'Bypass-Tunnel-Reminder': 'true',
+    'User-Agent': 'iRacingTelemetryDashboard/1.0'
+}
+
+def cloud_rows_to_df(df):
+    if df.empty: return pd.DataFrame()
+    mapping = {
+        "driver":         "Piloto",
+        "lap":            "Volta",
+        "lap_time":       "Tempo",
+        "fuel":           "Combustivel_Restante",
+        "position":       "Pos_Geral",
+        "class_position": "Pos_Classe",
+        "session_type":   "Sessao",    # FIX: Practice/Qualify/Race real
+        "timestamp":      "Timestamp",
+        "state":          "state",
+        # Métricas derivadas calculadas pelo servidor no ingest
+        "avg_lap_3":      "Media_3_Voltas",
+        "fuel_used":      "Consumo_Volta",
+        "avg_fuel_3":     "Media_Consumo_3_Voltas",
     }
+    df = df.rename(columns={k: v for k, v in mapping.items() if k in df.columns})
+    if "Sessao" not in df.columns: df["Sessao"] = "Race"
+    return df
+
+# ==============================
+# CACHE INCREMENTAL DA SESSÃO CLOUD
+# ==============================
+# As linhas recebidas ficam acumuladas em st.session_state; cada rerun só pede
+# ao servidor o que veio depois do último id (since_id), com If-None-Match para
+# receber 304 quando nada mudou. O mesmo buffer é usado pelo modo stream (SSE).
+# As páginas chegam em formato colunar (msgpack se disponível) e viram DataFrame
+# direto, sem montar um dict por linha.
+
+COLUMNS_MEDIA_TYPE = "application/vnd.telemetry.columns+json"
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+def _cloud_buffer(base_url, session_id):
+    return st.session_state.setdefault(
+        f"cloud_{base_url}_{session_id}", {"frames": [], "last_id": 0, "etag": None, "generation": None}
+    )
+
+def clear_cloud_buffer(base_url, session_id):
+    st.session_state.pop(f"cloud_{base_url}_{session_id}", None)
+
+def get_buffered_data(base_url, session_id):
+    buffer = _cloud_buffer(base_url, session_id)
+    frames = [f for f in buffer["frames"] if not f.empty]
+    if not frames: return pd.DataFrame()
+    # Compacta as páginas num único DataFrame: o próximo rerun só concatena o que for novo.
+    buffer["frames"] = [pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]]
+    return cloud_rows_to_df(buffer["frames"][0])
+
+def _decode_page(response):
+    if response.headers.get("Content-Type", "").startswith(MSGPACK_MEDIA_TYPE):
+        page = msgpack.unpackb(response.content, raw=False)
+    else:
+        page = response.json()
+    frame = pd.DataFrame(page["columns"]) if "columns" in page else pd.DataFrame(page.get("rows", []))
+    return page, frame
+
+def fetch_cloud_data(base_url, session_id):
+    buffer = _cloud_buffer(base_url, session_id)
+    url = f"{base_url}/session/{session_id}"
     try:
-        response = requests.get(url, headers=headers, timeout=5)
-        response.raise_for_status()
-        if response.status_code == 200:
-            data = response.json()
-            if not data: return pd.DataFrame()
-            df = pd.DataFrame(data)
-            mapping = {
-                "driver":         "Piloto",
-                "lap":            "Volta",
-                "lap_time":       "Tempo",
-                "fuel":           "Combustivel_Restante",
-                "position":       "Pos_Geral",
-                "class_position": "Pos_Classe",
-                "session_type":   "Sessao",    # FIX: Practice/Qualify/Race real
-                "timestamp":      "Timestamp",
-                "state":          "state"
-            }
-            df = df.rename(columns={k: v for k, v in mapping.items() if k in df.columns})
-            if "Sessao" not in df.columns: df["Sessao"] = "Race"
-            return df
-        return pd.DataFrame()
+        while True:
+            headers = {**CLOUD_HEADERS, "Accept": MSGPACK_MEDIA_TYPE if msgpack else COLUMNS_MEDIA_TYPE}
+            if buffer["etag"]:
+                headers["If-None-Match"] = buffer["etag"]
+            response = requests.get(url, params={"since_id": buffer["last_id"]}, headers=headers, timeout=5)
+            if response.status_code == 304:
+                break
+            response.raise_for_status()
+            page, frame = _decode_page(response)
+            generation = page.get("generation")
+            if page["max_id"] < buffer["last_id"] or (
+                buffer["generation"] is not None and generation != buffer["generation"]
+            ):
+                # Sessão foi resetada por outro usuário (ids recomeçaram): recomeça do zero.
+                clear_cloud_buffer(base_url, session_id)
+                buffer = _cloud_buffer(base_url, session_id)
+                continue
+            buffer["generation"] = generation
+            buffer["frames"].append(frame)
+            buffer["last_id"] = page["next_since_id"]
+            if not page["has_more"]:
+                buffer["etag"] = response.headers.get("ETag")
+                break
     except Exception as e:
         st.error(f"⚠️ Erro de conexão com o servidor de telemetria: Verifique a URL.")
+    return get_buffered_data(base_url, session_id)
+
+def fetch_session_export(base_url, session_id):
+    """Sessão inteira de uma vez via /session/{id}.parquet (análise pós-corrida)."""
+    try:
+        response = requests.get(f"{base_url}/session/{quote(session_id, safe='')}.parquet",
+                                headers=CLOUD_HEADERS, timeout=60)
+        if response.status_code == 404:
+            st.sidebar.warning(f"Sessão '{session_id}' não encontrada no servidor.")
+            return pd.DataFrame()
+        response.raise_for_status()
+        return cloud_rows_to_df(pd.read_parquet(io.BytesIO(response.content)))
+    except Exception as e:
+        st.sidebar.error(f"⚠️ Falha ao baixar a sessão: {e}")
         return pd.DataFrame()
 
+# ==============================
+# STREAM AO VIVO (SSE)
+# ==============================
+
+def _iter_sse(response):
+    """Gera (evento, dados) do stream; comentários (keepalive) geram (None, None)."""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None: continue
+        if line == "":
+            if data: yield event, "\n".join(data)
+            event, data = None, []
+        elif line.startswith(":"):
+            yield None, None
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event": event = value
+            elif field == "data": data.append(value)
+
+def wait_for_stream_update(base_url, session_id, timeout_s):
+    """Bloqueia até chegar um lote novo pelo stream (ou até `timeout_s`). Retorna True se chegou."""
+    buffer = _cloud_buffer(base_url, session_id)
+    deadline = time.monotonic() + timeout_s
+    params = {"since_id": buffer["last_id"]}
+    if buffer["generation"] is not None:
+        params["generation"] = buffer["generation"]   # servidor recomeça do zero se a sessão foi recriada
+    try:
+        with requests.get(
+            f"{base_url}/session/{session_id}/stream",
+            params=params,
+            headers={**CLOUD_HEADERS, "Accept": "text/event-stream"},
+            stream=True, timeout=(5, STREAM_KEEPALIVE_S + 5)
+        ) as response:
+            response.raise_for_status()
+            for event, data in _iter_sse(response):
+                if event == "rows":
+                    batch = json.loads(data)
+                    generation, rows = batch["generation"], batch["rows"]
+                    if buffer["generation"] is not None and generation != buffer["generation"]:
+                        # Sessão foi resetada por outro usuário (ids recomeçaram): recomeça do zero.
+                        clear_cloud_buffer(base_url, session_id)
+                        buffer = _cloud_buffer(base_url, session_id)
+                    buffer["generation"] = generation
+                    if rows:
+                        buffer["frames"].append(pd.DataFrame(rows))
+                        buffer["last_id"] = rows[-1]["id"]
+                        return True
+                if time.monotonic() >= deadline:
+                    return False
+    except requests.exceptions.ReadTimeout:
+        return False
+    except Exception:
+        st.error("⚠️ Erro no stream ao vivo: Verifique a URL ou desative o modo stream.")
+        time.sleep(min(timeout_s, 5))
+    return False
+
 def normalize_telemetry(df):
     if df.empty: return df
     mapping = {
@@ -100,26 +240,52 @@ def normalize_telemetry(df):
 # INTERFACE DE STATUS
 # ==============================
 
-def render_traffic_light(status_data, is_cloud=False, df=None):
+def fetch_presence(base_url, session_id):
+    """Último estado de cada piloto (heartbeats) — None se o servidor não tiver o endpoint."""
+    try:
+        response = requests.get(f"{base_url}/session/{session_id}/presence", headers=CLOUD_HEADERS, timeout=5)
+        response.raise_for_status()
+        return {p["driver"]: p for p in response.json()}
+    except Exception:
+        return None
+
+def _status_from_rows(df):
+    """Fallback para servidores sem /presence: estado pela última linha de cada piloto."""
+    status = []
+    for row in df.groupby('Piloto').tail(1).itertuples():
+        received_ms = getattr(row, "received_ms", None)
+        if pd.notna(received_ms):
+            # Servidor com received_ms: idade pelo relógio do servidor, sem adivinhar fuso
+            status.append((getattr(row, "Piloto", "Unknown"), getattr(row, "state", "offline"),
+                           max(0.0, time.time() - received_ms / 1000)))
+            continue
+        timestamp_str = getattr(row, "Timestamp", "00:00:00")
+        try:
+            last_ts = datetime.strptime(timestamp_str, "%H:%M:%S")
+            fuso_br = pytz.timezone('America/Sao_Paulo')
+            hora_atual_br = datetime.now(fuso_br).strftime("%H:%M:%S")
+            now_ts = datetime.strptime(hora_atual_br, "%H:%M:%S")
+            diff = abs((now_ts - last_ts).total_seconds())
+        except:
+            diff = 0
+        status.append((getattr(row, "Piloto", "Unknown"), getattr(row, "state", "offline"), diff))
+    return status
+
+def render_traffic_light(status_data, is_cloud=False, df=None, presence=None):
     if is_cloud:
-        if df is not None and not df.empty:
+        if presence:
+            # Latência medida pelo relógio do servidor (sem depender do fuso do piloto)
+            team_status = [(p["driver"], p.get("state", "offline"), p.get("age_s", 0)) for p in presence.values()]
+        elif df is not None and not df.empty:
+            team_status = _status_from_rows(df)
+        else:
+            team_status = []
+        if team_status:
             st.subheader("📡 Status da Equipe (Cloud)")
-            df_last_status = df.groupby('Piloto').tail(1)
-            cols = st.columns(len(df_last_status))
+            cols = st.columns(len(team_status))
             colors = {"offline": "🔴", "connected": "🟡", "cockpit": "🟢"}
             labels = {"offline": "OFFLINE", "connected": "BOX / MENU", "cockpit": "NO CARRO"}
-            for idx, row in enumerate(df_last_status.itertuples()):
-                state = getattr(row, "state", "offline")
-                driver = getattr(row, "Piloto", "Unknown")
-                timestamp_str = getattr(row, "Timestamp", "00:00:00")
-                try:
-                    last_ts = datetime.strptime(timestamp_str, "%H:%M:%S")
-                    fuso_br = pytz.timezone('America/Sao_Paulo')
-                    hora_atual_br = datetime.now(fuso_br).strftime("%H:%M:%S")
-                    now_ts = datetime.strptime(hora_atual_br, "%H:%M:%S")
-                    diff = abs((now_ts - last_ts).total_seconds())
-                except:
-                    diff = 0
+            for idx, (driver, state, diff) in enumerate(team_status):
                 if diff > 15:
                     state = "offline"
                 with cols[idx]:
@@ -143,8 +309,9 @@ def render_traffic_light(status_data, is_cloud=False, df=None):
 # RENDERIZAÇÃO DE MÉTRICAS
 # ==============================
 
-def render_metrics(df):
+def render_metrics(df, presence=None):
     if df.empty: return
+    presence = presence or {}
 
     col_driver, col_race = st.columns(2)
 
@@ -155,6 +322,9 @@ def render_metrics(df):
         df_cockpit = df[df['state'] == 'cockpit']
         if not df_cockpit.empty:
             piloto_ativo = df_cockpit.iloc[-1]['Piloto']
+    in_car = [p["driver"] for p in presence.values() if p.get("state") == "cockpit" and p.get("age_s", 0) <= 15]
+    if in_car:
+        piloto_ativo = in_car[0]
 
     default_driver_idx = pilotos_disponiveis.index(piloto_ativo) if piloto_ativo in pilotos_disponiveis else 0
 
@@ -207,14 +377,24 @@ def render_metrics(df):
     # Voltas válidas — df_valid é EXCLUSIVO do piloto selecionado (FIX #1)
     df_valid = df_p[df_p['Tempo'] > 0].copy().sort_values('Volta').reset_index(drop=True)
 
-    # Recalcula métricas isoladas do piloto (sem contaminação de rolling entre pilotos)
-    if not df_valid.empty:
+    # Servidor novo já manda as métricas por piloto (calculadas no ingest); só
+    # recalcula isoladas do piloto (sem contaminação de rolling entre pilotos) se faltarem.
+    derived_cols = ['Media_3_Voltas', 'Consumo_Volta', 'Media_Consumo_3_Voltas']
+    from_server = all(c in df_valid.columns for c in derived_cols) and df_valid[derived_cols].notna().all().all()
+    if not df_valid.empty and not from_server:
         df_valid['Media_3_Voltas'] = df_valid['Tempo'].rolling(3).mean().fillna(df_valid['Tempo'])
         df_valid['Consumo_Volta'] = df_valid['Combustivel_Restante'].shift(1) - df_valid['Combustivel_Restante']
         df_valid['Consumo_Volta'] = df_valid['Consumo_Volta'].apply(lambda x: x if 0 < x < 20 else 0)
         df_valid['Media_Consumo_3_Voltas'] = df_valid['Consumo_Volta'].rolling(3).mean().fillna(df_valid['Consumo_Volta'])
 
     last_row = df_p.iloc[-1]
+    # Heartbeats não ficam mais na tabela de voltas: combustível e posição atuais vêm da presença.
+    live = presence.get(piloto_selected)
+    if live and live.get("session_type") == session_selected:
+        last_row = last_row.copy()
+        last_row["Combustivel_Restante"] = live["fuel"]
+        last_row["Pos_Geral"]            = live["position"]
+        last_row["Pos_Classe"]           = live["class_position"]
     avg_cons_3v = float(df_valid.iloc[-1]['Media_Consumo_3_Voltas']) if not df_valid.empty else 0
     # FIX #7: usa consumo da última volta (= lógica do iRacing), fallback para média 3v
     last_cons   = float(df_valid.iloc[-1]['Consumo_Volta'])         if not df_valid.empty else 0
@@ -374,6 +554,8 @@ app_mode = st.sidebar.radio("Operação", ["📡 Live Telemetry", "📂 Post-Rac
 
 df_live = pd.DataFrame()
 is_cloud_active = False
+use_stream = False
+presence_live = None
 base_url = ""
 session_id = ""
 
@@ -383,11 +565,20 @@ if app_mode == "📡 Live Telemetry":
     if conn_mode == "Cloud (API Server)":
         server_ip  = st.sidebar.text_input("URL Base do Servidor", "https://iracing-telemetry-vfak.onrender.com")
         session_id = st.sidebar.text_input("ID Sessão", "Daytona_Test")
+        use_stream = st.sidebar.checkbox("⚡ Stream ao vivo (SSE)", value=False,
+                                         help="Recebe voltas novas por push em vez de consultar a cada "
+                                              f"{REFRESH_RATE_ST}s")
         base_url   = server_ip.strip().rstrip('/')
-        CLOUD_URL  = f"{base_url}/session/{session_id}"
-        df_live    = fetch_cloud_data(CLOUD_URL)
+        if use_stream:
+            # Primeira carga: o stream entrega imediatamente o histórico da sessão.
+            if not _cloud_buffer(base_url, session_id)["frames"]:
+                wait_for_stream_update(base_url, session_id, timeout_s=5)
+            df_live = get_buffered_data(base_url, session_id)
+        else:
+            df_live = fetch_cloud_data(base_url, session_id)
         is_cloud_active = True
-        render_traffic_light({}, is_cloud=True, df=df_live)
+        presence_live = fetch_presence(base_url, session_id)
+        render_traffic_light({}, is_cloud=True, df=df_live, presence=presence_live)
 
         # FIX #6: reset de sessão — requer endpoint DELETE /session/{id} no FastAPI
         st.sidebar.divider()
@@ -396,6 +587,7 @@ if app_mode == "📡 Live Telemetry":
             try:
                 r = requests.delete(f"{base_url}/session/{session_id}", timeout=5)
                 if r.status_code == 200:
+                    clear_cloud_buffer(base_url, session_id)
                     st.sidebar.success("✅ Sessão resetada com sucesso!")
                     st.rerun()
                 else:
@@ -412,8 +604,16 @@ if app_mode == "📡 Live Telemetry":
         render_traffic_light(get_status_local(), is_cloud=False)
 
 else:
-    uploaded = st.sidebar.file_uploader("Carregar CSV", type="csv")
-    if uploaded: df_live = pd.read_csv(uploaded)
+    source = st.sidebar.selectbox("Fonte", ["Arquivo CSV", "Servidor (Parquet)"])
+    if source == "Servidor (Parquet)":
+        server_ip  = st.sidebar.text_input("URL Base do Servidor", "https://iracing-telemetry-vfak.onrender.com")
+        session_id = st.sidebar.text_input("ID Sessão", "Daytona_Test")
+        if st.sidebar.button("📥 Carregar sessão"):
+            st.session_state["post_race_df"] = fetch_session_export(server_ip.strip().rstrip('/'), session_id)
+        df_live = st.session_state.get("post_race_df", pd.DataFrame())
+    else:
+        uploaded = st.sidebar.file_uploader("Carregar CSV", type="csv")
+        if uploaded: df_live = pd.read_csv(uploaded)
 
 st.title(f"🏎️ {app_mode}")
 if is_cloud_active:
@@ -422,10 +622,14 @@ if is_cloud_active:
 
 if not df_live.empty:
     df_normalized = normalize_telemetry(df_live)
-    render_metrics(df_normalized)
+    render_metrics(df_normalized, presence=presence_live)
 else:
     st.info("Aguardando entrada de dados...")
 
 if app_mode == "📡 Live Telemetry":
-    time.sleep(REFRESH_RATE_ST)
+    if use_stream:
+        # Em vez de dormir, espera o próximo lote do servidor: a tela atualiza assim que a volta chega.
+        wait_for_stream_update(base_url, session_id, REFRESH_RATE_ST)
+    else:
+        time.sleep(REFRESH_RATE_ST)
     st.rerun()
\ No newline at end of file
@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_PATH, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_READ_WORKERS, DB_BULK_WORKERS
+
+# ==============================
+# Camada de conexão SQLite
+# ==============================
+# Cada thread reaproveita a própria conexão em vez de abrir uma nova por
+# requisição. O pool fica limitado ao número de threads que tocam o banco
+# (executores abaixo + escritor), e todas as conexões são registradas para
+# fechamento no shutdown.
+#
+# WAL permite que leituras (/session) rodem em paralelo com a escrita (/telemetry),
+# em vez de serializarem no lock do rollback journal.
+
+_local = threading.local()
+_registry_lock = threading.Lock()
+_open_conns = set()
+_generation = 0   # incrementa em close_all(): invalida as conexões guardadas nas threads
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')       # seguro em WAL, fsync só no checkpoint
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    return conn
+
+
+def get_db(path=DB_PATH):
+    """Retorna a conexão da thread atual para `path`, abrindo-a na primeira chamada."""
+    if getattr(_local, 'generation', None) != _generation:
+        _local.conns = {}
+        _local.generation = _generation
+    conn = _local.conns.get(path)
+    if conn is None:
+        conn = connect(path)
+        _local.conns[path] = conn
+        with _registry_lock:
+            _open_conns.add(conn)
+    return conn
+
+
+def close_all():
+    """Faz checkpoint do WAL e fecha todas as conexões abertas (usado no shutdown)."""
+    global _generation
+    with _registry_lock:
+        _generation += 1
+        for conn in _open_conns:
+            try:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except sqlite3.Error:
+                pass
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        _open_conns.clear()
+
+
+# ==============================
+# Executores dedicados do banco
+# ==============================
+# Os endpoints são async e mandam o trabalho de SQLite para estes executores,
+# fora do threadpool genérico do FastAPI. Operações pesadas (arquivar, apagar,
+# exportar) têm o próprio executor: uma exportação grande não ocupa as threads
+# de leitura, e o ingest nem passa por aqui (vai direto para o writer).
+_read_executor = ThreadPoolExecutor(DB_READ_WORKERS, thread_name_prefix='db-read')
+_bulk_executor = ThreadPoolExecutor(DB_BULK_WORKERS, thread_name_prefix='db-bulk')
+
+
+async def run_db(fn, *args, bulk=False, **kwargs):
+    """Executa `fn(*args, **kwargs)` numa thread de banco sem bloquear o event loop."""
+    executor = _bulk_executor if bulk else _read_executor
+    return await asyncio.get_running_loop().run_in_executor(
+        executor, functools.partial(fn, *args, **kwargs)
+    )
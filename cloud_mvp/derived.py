@@ -0,0 +1,99 @@
+from collections import deque
+
+# ==============================
+# Métricas derivadas por volta (calculadas no ingest)
+# ==============================
+# Mesmas regras do render_metrics do dashboard, por (sessão, tipo de sessão, piloto),
+# considerando só voltas válidas (lap_time > 0) em ordem de volta:
+#   avg_lap_3  → Media_3_Voltas:          média das 3 últimas voltas (a própria nas 2 primeiras)
+#   fuel_used  → Consumo_Volta:           combustível da volta válida anterior menos o atual,
+#                                         0 fora de (0, 20) e na primeira volta
+#   avg_fuel_3 → Media_Consumo_3_Voltas:  média dos 3 últimos consumos (o próprio nos 2 primeiros)
+#
+# As janelas ficam em memória e só avançam depois que a volta foi de fato inserida.
+# Sem janela (início do servidor) ou com volta fora de ordem, a janela é montada
+# a partir das voltas anteriores já gravadas (na conexão de quem está inserindo);
+# se o SQLite tiver menos de 3 e a sessão tiver sido arquivada, o restante vem
+# do Parquet (load_archived).
+
+DERIVED_FIELDS = ('avg_lap_3', 'fuel_used', 'avg_fuel_3')
+
+PREVIOUS_LAPS_SQL = (
+    'SELECT lap, lap_time, fuel FROM telemetry '
+    'WHERE session_id=? AND session_type=? AND driver=? AND lap_time > 0 AND lap < ? '
+    'ORDER BY lap DESC LIMIT 3'
+)
+
+
+def fuel_delta(previous_fuel, fuel):
+    used = previous_fuel - fuel if previous_fuel is not None else 0
+    return used if 0 < used < 20 else 0
+
+
+class _Window:
+    __slots__ = ('last_lap', 'last_fuel', 'times', 'fuel_used')
+
+    def __init__(self, rows=()):
+        """`rows`: até 3 voltas válidas anteriores (lap, lap_time, fuel), em ordem."""
+        self.last_lap = rows[-1][0] if rows else None
+        self.last_fuel = rows[-1][2] if rows else None
+        self.times = deque((r[1] for r in rows[-2:]), maxlen=2)
+        used = [fuel_delta(rows[i - 1][2] if i else None, rows[i][2]) for i in range(len(rows))]
+        # Com 3 linhas, a primeira não tem anterior conhecido, mas só os 2 últimos consumos importam.
+        self.fuel_used = deque(used[-2:], maxlen=2)
+
+
+class LapWindows:
+    """Janelas por piloto. Usada só pela thread do writer."""
+
+    def __init__(self, load_archived=None):
+        # load_archived(session_id, session_type, driver, lap) → voltas válidas
+        # arquivadas (lap, lap_time, fuel) anteriores a `lap`, em qualquer ordem
+        self._load_archived = load_archived
+        self._windows = {}
+
+    def derive(self, db, d):
+        """Valores derivados da volta `d` (None para voltas inválidas), sem avançar a janela."""
+        if d.lap_time <= 0:
+            return None, None, None
+        window = self._window(db, d)
+        used = fuel_delta(window.last_fuel, d.fuel)
+        avg_lap = (sum(window.times) + d.lap_time) / 3 if len(window.times) == 2 else d.lap_time
+        avg_fuel = (sum(window.fuel_used) + used) / 3 if len(window.fuel_used) == 2 else used
+        return round(avg_lap, 3), round(used, 3), round(avg_fuel, 3)
+
+    def commit(self, d, values):
+        """Avança a janela com uma volta que foi inserida."""
+        if values[0] is None:
+            return
+        key = (d.session_id, d.session_type, d.driver)
+        window = self._windows.get(key)
+        if window is None or (window.last_lap is not None and d.lap <= window.last_lap):
+            return   # volta fora de ordem não mexe na janela (que já está à frente)
+        window.times.append(d.lap_time)
+        window.fuel_used.append(values[1])
+        window.last_lap, window.last_fuel = d.lap, d.fuel
+
+    def forget(self, session_id=None):
+        """Descarta janelas (de uma sessão ou todas); serão recarregadas do banco."""
+        if session_id is None:
+            self._windows.clear()
+            return
+        for key in list(self._windows):   # pode ser chamada fora da thread do writer
+            if key[0] == session_id:
+                self._windows.pop(key, None)
+
+    def _window(self, db, d):
+        key = (d.session_id, d.session_type, d.driver)
+        window = self._windows.get(key)
+        if window is not None and (window.last_lap is None or d.lap > window.last_lap):
+            return window
+        rows = [tuple(r) for r in db.execute(PREVIOUS_LAPS_SQL, (*key, d.lap))]
+        if len(rows) < 3 and self._load_archived is not None:
+            merged = {r[0]: r for r in self._load_archived(*key, d.lap)}
+            merged.update((r[0], r) for r in rows)
+            rows = sorted(merged.values(), reverse=True)[:3]
+        loaded = _Window(list(reversed(rows)))
+        if window is None:
+            self._windows[key] = loaded
+        return loaded
@@ -0,0 +1,64 @@
+import gzip
+import json
+
+# ==============================
+# Formatos de resposta de /session/{id}
+# ==============================
+# rows    → JSON orientado a linhas (lista de objetos), formato original
+# columns → JSON colunar: {"coluna": [valores...]}, sem repetir as chaves por linha
+# msgpack → mesmo payload colunar em MessagePack (binário, menor e mais rápido)
+#
+# orjson e msgpack são opcionais: sem eles o servidor cai para json/colunar JSON.
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COLUMNS_MEDIA_TYPE = 'application/vnd.telemetry.columns+json'
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+GZIP_MIN_BYTES = 1024
+
+
+def negotiate_format(accept, fmt=None):
+    """Escolhe o formato pelo parâmetro `format` ou pelo cabeçalho Accept."""
+    if fmt is None:
+        accept = accept or ''
+        if MSGPACK_MEDIA_TYPE in accept:
+            fmt = 'msgpack'
+        elif COLUMNS_MEDIA_TYPE in accept:
+            fmt = 'columns'
+        else:
+            fmt = 'rows'
+    if fmt == 'msgpack' and msgpack is None:
+        fmt = 'columns'
+    return fmt if fmt in ('rows', 'columns', 'msgpack') else 'rows'
+
+
+def to_columns(names, rows):
+    """Transpõe linhas (tuplas/sqlite3.Row) em {coluna: [valores]}."""
+    if not rows:
+        return {name: [] for name in names}
+    return {name: list(values) for name, values in zip(names, zip(*rows))}
+
+
+def encode(payload, fmt):
+    """Serializa o payload; retorna (bytes, media_type)."""
+    if fmt == 'msgpack':
+        return msgpack.packb(payload, use_bin_type=True), MSGPACK_MEDIA_TYPE
+    media_type = COLUMNS_MEDIA_TYPE if fmt == 'columns' else 'application/json'
+    if orjson is not None:
+        return orjson.dumps(payload), media_type
+    return json.dumps(payload, separators=(',', ':')).encode(), media_type
+
+
+def maybe_gzip(body, accept_encoding):
+    """Comprime com gzip se o cliente aceitar e o corpo valer a pena."""
+    if len(body) >= GZIP_MIN_BYTES and 'gzip' in (accept_encoding or ''):
+        return gzip.compress(body, compresslevel=5), {'Content-Encoding': 'gzip'}
+    return body, {}
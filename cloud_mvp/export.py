@@ -0,0 +1,80 @@
+# ==============================
+# Exportação em massa de uma sessão (Parquet / Arrow IPC)
+# ==============================
+# /session/{id}.parquet e /session/{id}.arrow escrevem a sessão em blocos de
+# EXPORT_CHUNK_ROWS linhas direto do SQLite (e do Parquet arquivado), então a
+# memória fica limitada a um bloco, não à sessão inteira. Cada bloco vira um
+# row group (Parquet) ou um record batch (Arrow) e já sai na resposta.
+#
+# pyarrow é opcional: sem ele os endpoints respondem 503.
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+EXPORT_FORMATS = {
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow':   'application/vnd.apache.arrow.stream',
+}
+
+
+def export_available():
+    return pa is not None
+
+
+def arrow_schema(columns):
+    """Schema Arrow a partir de [(nome, tipo declarado no SQLite), ...]."""
+    types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    return pa.schema([(name, types.get(decl.upper(), pa.string())) for name, decl in columns])
+
+
+class _Sink:
+    """Arquivo só-escrita que acumula bytes até alguém buscá-los com take()."""
+
+    def __init__(self):
+        self._chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+
+class StreamWriter:
+    """Serializa blocos de linhas no formato pedido e devolve os bytes prontos."""
+
+    def __init__(self, fmt, schema):
+        self._schema = schema
+        self._sink = _Sink()
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(self._sink, schema, compression='zstd')
+        else:
+            self._writer = pa.ipc.new_stream(self._sink, schema)
+
+    def write(self, names, rows):
+        """Bloco de linhas com colunas `names` (ordem do banco de origem, que pode
+        variar entre arquivos de sessão); colunas ausentes vão como nulas."""
+        columns = dict(zip(names, zip(*rows)))
+        batch = pa.record_batch(
+            [pa.array(columns.get(field.name, [None] * len(rows)), type=field.type)
+             for field in self._schema],
+            schema=self._schema,
+        )
+        self._writer.write_table(pa.Table.from_batches([batch]))
+        return self._sink.take()
+
+    def close(self):
+        self._writer.close()
+        return self._sink.take()
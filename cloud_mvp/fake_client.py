@@ -1,47 +1,201 @@
-import requests
-import time
+"""Simulador / gerador de carga da telemetria.
+
+Simula N equipes × M pilotos enviando voltas e heartbeats, mais leitores no
+estilo do dashboard, contra um `uvicorn server:app` local. No final imprime
+vazão e latências p50/p95/p99 por endpoint.
+
+    uvicorn server:app --port 8000
+    python fake_client.py --teams 10 --drivers 3 --lap-interval 2 --readers 20 --duration 120
+
+Sem argumentos roda como antes: 1 equipe, 1 piloto, uma volta a cada 2 s.
+"""
+import argparse
+import asyncio
 import random
+import time
 from datetime import datetime
 
-SERVER_URL = "https://iracingcloud.loca.lt/telemetry"
-SESSION_ID = "Daytona_Test"
+import httpx
+
+SERVER_URL = "http://127.0.0.1:8000"
 
-driver_name = "Rodrigo"
-user_id = 739024
+# --- O SEGREDO ESTÁ AQUI: O CRACHÁ PARA PULAR A TELA DO LOCALTUNNEL ---
+HEADERS = {
+    "Bypass-Tunnel-Reminder": "true",
+    "User-Agent": "iRacingTelemetryClient/1.0"
+}
 
-lap = 0
-fuel = 20.0
 
-print("🚀 Simulador de Telemetria iniciado...")
+# ==============================
+# Estatísticas por endpoint
+# ==============================
+class Stats:
+    def __init__(self):
+        self.latencies = {}   # endpoint -> [segundos]
+        self.errors = {}      # endpoint -> contagem
+        self.started = time.perf_counter()
 
-while True:
-    lap += 1
-    lap_time = round(random.uniform(16.8, 18.2), 3)
-    fuel -= round(random.uniform(0.1, 0.2), 3)
+    def record(self, endpoint, seconds, ok):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
 
-    data = {
-        "session_id": SESSION_ID,
-        "driver": driver_name,
-        "user_id": user_id,
-        "lap": lap,
-        "lap_time": lap_time,
-        "fuel": round(fuel, 3),
-        "position": random.randint(1, 5),
-        "timestamp": datetime.now().strftime("%H:%M:%S"),
-        "state": "cockpit" 
-    }   
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        print(f"\n📊 {elapsed:.1f}s de carga")
+        print(f"{'endpoint':<28}{'reqs':>8}{'erros':>7}{'req/s':>9}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+        for endpoint in sorted(self.latencies):
+            samples = sorted(self.latencies[endpoint])
+            n = len(samples)
+            p = lambda q: samples[min(n - 1, int(q * n))] * 1000
+            print(f"{endpoint:<28}{n:>8}{self.errors.get(endpoint, 0):>7}{n / elapsed:>9.1f}"
+                  f"{p(0.50):>9.1f}{p(0.95):>9.1f}{p(0.99):>9.1f}{samples[-1] * 1000:>9.1f}")
 
-    # --- O SEGREDO ESTÁ AQUI: O CRACHÁ PARA PULAR A TELA DO LOCALTUNNEL ---
-    headers = {
-        "Bypass-Tunnel-Reminder": "true",
-        "User-Agent": "iRacingTelemetryClient/1.0"
-    }
 
+async def timed(stats, endpoint, request):
+    start = time.perf_counter()
     try:
-        # Passando os headers na requisição
-        response = requests.post(SERVER_URL, json=data, headers=headers)
-        print(f"🏁 Lap {lap} enviada | {lap_time}s | Fuel: {fuel:.2f} | Status: {data['state']} | HTTP: {response.status_code}")
-    except Exception as e:
-        print("❌ Erro ao enviar:", e)
+        response = await request
+        ok = response.status_code < 400
+    except httpx.HTTPError:
+        response, ok = None, False
+    stats.record(endpoint, time.perf_counter() - start, ok)
+    return response
+
+
+# ==============================
+# Pilotos
+# ==============================
+async def driver_loop(client, stats, args, session_id, driver_name, user_id, stop, verbose):
+    lap = 0
+    fuel = 20.0
+    next_lap = time.monotonic() + random.uniform(0, args.lap_interval)   # espalha as largadas
+    while not stop.is_set():
+        now = time.monotonic()
+        if now >= next_lap:
+            lap += 1
+            lap_time = round(random.uniform(16.8, 18.2), 3)
+            fuel = max(0.0, fuel - round(random.uniform(0.1, 0.2), 3))
+            data = {
+                "session_id": session_id,
+                "driver": driver_name,
+                "user_id": user_id,
+                "lap": lap,
+                "lap_time": lap_time,
+                "fuel": round(fuel, 3),
+                "position": random.randint(1, 5),
+                "timestamp": datetime.now().strftime("%H:%M:%S"),
+                "state": "cockpit",
+                "client_ms": int(time.time() * 1000)
+            }
+            response = await timed(stats, "POST /telemetry", client.post("/telemetry", json=data))
+            if verbose:
+                status = response.status_code if response is not None else "erro"
+                print(f"🏁 Lap {lap} enviada | {lap_time}s | Fuel: {fuel:.2f} | HTTP: {status}")
+            next_lap += args.lap_interval
+        if args.heartbeat_interval > 0:
+            presence = {
+                "session_id": session_id,
+                "driver": driver_name,
+                "state": "cockpit",
+                "fuel": round(fuel, 3),
+                "position": random.randint(1, 5),
+                "timestamp": datetime.now().strftime("%H:%M:%S"),
+            }
+            await timed(stats, "POST /presence", client.post("/presence", json=presence))
+            wait = min(args.heartbeat_interval, max(0.0, next_lap - time.monotonic()))
+        else:
+            wait = max(0.0, next_lap - time.monotonic())
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
 
-    time.sleep(2)
\ No newline at end of file
+
+# ==============================
+# Leitores (como o dashboard)
+# ==============================
+async def reader_loop(client, stats, args, session_ids, stop):
+    """Leitura incremental com ETag, presença e, de vez em quando, o resumo."""
+    session_id = random.choice(session_ids)
+    last_id, etag = 0, None
+    await asyncio.sleep(random.uniform(0, args.read_interval))
+    while not stop.is_set():
+        headers = {"If-None-Match": etag} if etag else {}
+        while True:   # pagina como o dashboard enquanto has_more
+            response = await timed(stats, "GET /session", client.get(
+                f"/session/{session_id}", params={"since_id": last_id, "format": "columns"},
+                headers=headers))
+            if response is None or response.status_code != 200:
+                break
+            etag = response.headers.get("ETag")
+            page = response.json()
+            last_id = page["next_since_id"]
+            if not page["has_more"]:
+                break
+            headers = {}
+        await timed(stats, "GET /session/presence", client.get(f"/session/{session_id}/presence"))
+        if random.random() < 0.2:
+            await timed(stats, "GET /session/summary", client.get(f"/session/{session_id}/summary"))
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=args.read_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def main(args):
+    stats = Stats()
+    stop = asyncio.Event()
+    session_ids = [f"{args.session_prefix}_{t + 1}" for t in range(args.teams)]
+    limits = httpx.Limits(max_connections=args.max_connections,
+                          max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.url, headers=HEADERS, limits=limits,
+                                 timeout=args.timeout) as client:
+        verbose = args.teams * args.drivers == 1
+        tasks = [
+            asyncio.create_task(driver_loop(
+                client, stats, args, session_id, f"Driver_{t + 1}_{d + 1}",
+                100000 + t * 100 + d, stop, verbose))
+            for t, session_id in enumerate(session_ids)
+            for d in range(args.drivers)
+        ]
+        tasks += [
+            asyncio.create_task(reader_loop(client, stats, args, session_ids, stop))
+            for _ in range(args.readers)
+        ]
+        print(f"🚀 {args.teams} equipe(s) × {args.drivers} piloto(s), "
+              f"{args.readers} leitor(es) → {args.url}")
+        try:
+            if args.duration > 0:
+                await asyncio.sleep(args.duration)
+            else:
+                await asyncio.Event().wait()   # até Ctrl+C
+        finally:
+            stop.set()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            stats.report()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=SERVER_URL)
+    parser.add_argument("--teams", type=int, default=1, help="sessões simultâneas")
+    parser.add_argument("--drivers", type=int, default=1, help="pilotos por equipe")
+    parser.add_argument("--lap-interval", type=float, default=2.0, help="segundos entre voltas")
+    parser.add_argument("--heartbeat-interval", type=float, default=0.0,
+                        help="segundos entre heartbeats (0 = desligado)")
+    parser.add_argument("--readers", type=int, default=0, help="leitores estilo dashboard")
+    parser.add_argument("--read-interval", type=float, default=2.0)
+    parser.add_argument("--duration", type=float, default=0.0, help="segundos (0 = até Ctrl+C)")
+    parser.add_argument("--session-prefix", default="Daytona_Test")
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,160 @@
+import threading
+import time
+
+# ==============================
+# Métricas no formato texto do Prometheus
+# ==============================
+# Implementação mínima (sem dependência extra): contadores, histogramas e
+# gauges calculados na hora da coleta. Exposto em GET /metrics pelo server.py.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}   # labels -> [contagem por bucket..., soma, total]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        """Context manager que observa a duração do bloco em segundos."""
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    le = f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [le])} {count}')
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, [INF_LABEL])} {series[-1]}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {series[-2]}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {series[-1]}')
+        return lines
+
+
+class Gauge:
+    """Valor lido na coleta: `collect()` retorna um número ou [(labels_dict, valor), ...].
+    `kind='counter'` expõe contadores mantidos em outro lugar (ex: SessionCache)."""
+
+    def __init__(self, name, help_text, collect, labelnames=(), kind='gauge'):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._collect = collect
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        samples = self._collect()
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            key = tuple(labels.get(n, '') for n in self.labelnames)
+            lines.append(f'{self.name}{_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self._histogram, self._labels = histogram, labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+def render_all():
+    lines = []
+    for metric in _registry:
+        try:
+            lines.extend(metric.render())
+        except Exception:
+            continue    # uma métrica com erro não derruba a coleta inteira
+    return '\n'.join(lines) + '\n'
+
+
+# ─── Métricas HTTP (middleware ASGI) ─────────────────────
+http_requests = Counter(
+    'http_requests_total', 'Requisições HTTP por rota, método e status',
+    ('method', 'route', 'status'),
+)
+http_latency = Histogram(
+    'http_request_duration_seconds', 'Latência até o início da resposta, por rota',
+    ('method', 'route'),
+)
+
+
+class MetricsMiddleware:
+    """Mede contagem e latência por rota (template, ex: /session/{session_id})."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = {'code': 500}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                route = getattr(scope.get('route'), 'path', 'unmatched')
+                http_latency.observe(time.perf_counter() - start, method=scope['method'], route=route)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            http_requests.inc(method=scope['method'], route=route, status=str(status['code']))
@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote
+from db import connect
+from config import PARTITION_DIR, PARTITION_IDLE_S
+
+# ==============================
+# Armazenamento particionado por sessão
+# ==============================
+# No modo STORAGE_MODE="session" as voltas de cada sessão ficam num arquivo
+# SQLite próprio: leituras e varreduras só tocam as páginas da sessão, equipes
+# diferentes não disputam o mesmo lock de escrita e apagar uma sessão é remover
+# o arquivo. Catálogo e presença continuam no banco principal (DB_PATH).
+#
+# As conexões são emprestadas por `connection()` e devolvidas a um pool por
+# arquivo; o arquivo é aberto na primeira vez que é usado e as conexões sem uso
+# há PARTITION_IDLE_S são fechadas na devolução seguinte.
+
+
+class PartitionStore:
+    def __init__(self, init_schema, directory=PARTITION_DIR, idle_s=PARTITION_IDLE_S):
+        self._init_schema = init_schema    # cria tabela/índices num arquivo novo
+        self._dir = Path(directory)
+        self._idle_s = idle_s
+        self._lock = threading.Lock()
+        self._idle = {}          # path -> [(conn, último uso)] prontas para empréstimo
+        self._generation = {}    # path -> contador; release() invalida as emprestadas
+        self._ready = set()      # arquivos com schema garantido neste processo
+        self._next_sweep = 0.0
+
+    def path(self, session_id):
+        return self._dir / f"{quote(session_id, safe='')}.db"
+
+    def exists(self, session_id):
+        return self.path(session_id).exists()
+
+    @property
+    def open_count(self):
+        """Conexões ociosas no pool (as emprestadas não entram na conta)."""
+        with self._lock:
+            return sum(len(pool) for pool in self._idle.values())
+
+    @contextmanager
+    def connection(self, session_id):
+        """Empresta uma conexão para o arquivo da sessão (cria o arquivo se faltar)."""
+        path = self.path(session_id)
+        with self._lock:
+            generation = self._generation.get(path, 0)
+            pool = self._idle.get(path)
+            conn = pool.pop()[0] if pool else None
+        if conn is None:
+            conn = self._open(path)
+        try:
+            yield conn
+        finally:
+            self._release(path, conn, generation)
+
+    def release(self, session_id):
+        """Fecha as conexões do arquivo da sessão. Conexões emprestadas são
+        descartadas na devolução em vez de voltarem ao pool."""
+        path = self.path(session_id)
+        with self._lock:
+            self._generation[path] = self._generation.get(path, 0) + 1
+            conns = [conn for conn, _ in self._idle.pop(path, [])]
+            self._ready.discard(path)
+        for conn in conns:
+            self._close(conn)
+        return path
+
+    def drop(self, session_id):
+        """Remove o arquivo da sessão (e o WAL)."""
+        path = self.release(session_id)
+        for suffix in ('', '-wal', '-shm'):
+            Path(f'{path}{suffix}').unlink(missing_ok=True)
+
+    def close_all(self):
+        """Fecha as conexões ociosas (usado no shutdown, depois do writer)."""
+        with self._lock:
+            conns = [conn for pool in self._idle.values() for conn, _ in pool]
+            self._idle.clear()
+        for conn in conns:
+            self._close(conn, checkpoint=True)
+
+    # ─── Internos ───────────────────────────────────────
+    def _open(self, path):
+        self._dir.mkdir(parents=True, exist_ok=True)
+        conn = connect(str(path))
+        if path not in self._ready:
+            # Como no banco principal: auto_vacuum incremental antes das tabelas,
+            # para reclaim_space() devolver ao disco o que o arquivamento apagou.
+            # Arquivos de versões anteriores passam a valer após um VACUUM (uma vez).
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                conn.execute('VACUUM')
+            with conn:
+                self._init_schema(conn)
+            self._ready.add(path)
+        return conn
+
+    def _release(self, path, conn, generation):
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            if self._generation.get(path, 0) == generation and not conn.in_transaction:
+                self._idle.setdefault(path, []).append((conn, now))
+            else:
+                stale.append(conn)
+            if now >= self._next_sweep:
+                self._next_sweep = now + min(self._idle_s, 60)
+                stale += self._take_idle(now - self._idle_s)
+        for conn in stale:
+            self._close(conn)
+
+    def _take_idle(self, older_than):
+        taken = []
+        for path in list(self._idle):
+            keep = []
+            for conn, used in self._idle[path]:
+                (taken if used < older_than else keep).append((conn, used))
+            if keep:
+                self._idle[path] = keep
+            else:
+                del self._idle[path]
+        return [conn for conn, _ in taken]
+
+    @staticmethod
+    def _close(conn, checkpoint=False):
+        try:
+            if checkpoint:
+                conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            conn.close()
+        except sqlite3.Error:
+            pass
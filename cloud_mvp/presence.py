@@ -0,0 +1,48 @@
+import threading
+import time
+
+# ==============================
+# Registro de presença dos pilotos
+# ==============================
+# Heartbeats (estado, combustível e posição a cada ~2 s) não são voltas: em vez
+# de virarem linhas na tabela telemetry, atualizam o último estado conhecido de
+# cada piloto. A leitura (/session/{id}/presence) vem da memória, O(pilotos);
+# a tabela `presence` só guarda esse último estado para sobreviver a restarts.
+
+PRESENCE_FIELDS = ('session_id', 'driver', 'state', 'fuel', 'position',
+                   'class_position', 'session_type', 'timestamp', 'last_seen')
+
+PRESENCE_UPSERT_SQL = (
+    f"INSERT INTO presence ({', '.join(PRESENCE_FIELDS)}) "
+    f"VALUES ({', '.join('?' for _ in PRESENCE_FIELDS)}) "
+    'ON CONFLICT(session_id, driver) DO UPDATE SET '
+    + ', '.join(f'{f}=excluded.{f}' for f in PRESENCE_FIELDS[2:])
+)
+
+
+class PresenceRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}     # session_id -> {driver: dict}
+
+    def update(self, entry):
+        with self._lock:
+            self._sessions.setdefault(entry['session_id'], {})[entry['driver']] = entry
+
+    def load(self, rows):
+        for row in rows:
+            self.update(dict(row))
+
+    def drop(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get(self, session_id):
+        """Último estado de cada piloto da sessão, com a idade (s) medida no servidor."""
+        now = time.time()
+        with self._lock:
+            entries = list(self._sessions.get(session_id, {}).values())
+        return [
+            {**e, 'age_s': round(now - e['last_seen'], 1)}
+            for e in sorted(entries, key=lambda e: e['driver'])
+        ]
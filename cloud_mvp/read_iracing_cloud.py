@@ -2,10 +2,13 @@ import irsdk
 import time
 import pandas as pd
 import json
-import requests
 import argparse
 from collections import deque
-from config import LOG_DIR, WINDOW_SIZE
+from config import LOG_DIR, WINDOW_SIZE, STATUS_INTERVAL_S
+from uplink import Uplink
+from spool import LapSpool
+from lap_closure import LapClosure
+from sampler import SdkSampler
 
 # ==============================
 # FIX #5: Session ID via argparse + prompt interativo
@@ -44,7 +47,8 @@ def _resolve_session_id():
 # ==============================
 # Configuração Cloud
 # ==============================
-SERVER_URL = "https://iracing-telemetry-vfak.onrender.com/telemetry"
+BASE_URL     = "https://iracing-telemetry-vfak.onrender.com"
+SERVER_URL   = f"{BASE_URL}/telemetry"
 SESSION_ID = _resolve_session_id()
 print(f"\n🔑 Session ID ativo: '{SESSION_ID}'")
 
@@ -61,8 +65,17 @@ ir = irsdk.IRSDK()
 # Funções auxiliares
 # ==============================
 
+CLOUD_HEADERS = {
+    "Bypass-Tunnel-Reminder": "true",
+    "User-Agent": "iRacingTelemetryClient/1.0"
+}
+
+# Os POSTs saem numa thread própria (uplink.py): o loop do SDK não espera a rede.
+# Voltas passam pelo spool em disco e são reenviadas se a nuvem estiver fora.
+uplink = Uplink(BASE_URL, CLOUD_HEADERS, LapSpool())
+
 def send_to_cloud(data):
-    """Envia o pacote de telemetria para o servidor FastAPI"""
+    """Enfileira o pacote de telemetria para o servidor FastAPI"""
     try:
         data["session_id"] = SESSION_ID
         cloud_payload = {
@@ -76,46 +89,56 @@ def send_to_cloud(data):
             "class_position": data["Pos_Classe"],
             "session_type":   data["Sessao"],        # FIX: envia Practice/Race/Qualify
             "timestamp":      data["Timestamp"],
-            "state":          data["state"]
-        }
-        headers = {
-            "Bypass-Tunnel-Reminder": "true",
-            "User-Agent": "iRacingTelemetryClient/1.0"
+            "state":          data["state"],
+            "client_ms":      int(time.time() * 1000)   # latência ponta a ponta no servidor
         }
-        requests.post(SERVER_URL, json=cloud_payload, headers=headers, timeout=1.0)
+        uplink.send_lap(cloud_payload, f"Volta {cloud_payload['lap']}")
         return True
     except Exception as e:
         print(f"⚠️ Erro no Envio: {e}")
         return False
 
 
+def send_presence(state, driver, fuel_current, pos_g, pos_c, session_name):
+    """Agenda o heartbeat (estado atual do piloto) — não vira linha de volta no servidor"""
+    try:
+        presence_payload = {
+            "session_id":     SESSION_ID,
+            "driver":         driver,
+            "state":          state,
+            "fuel":           float(fuel_current),
+            "position":       pos_g,
+            "class_position": pos_c,
+            "session_type":   session_name,
+            "timestamp":      time.strftime("%H:%M:%S")
+        }
+        uplink.send_presence(presence_payload)
+        return True
+    except Exception as e:
+        print(f"⚠️ Erro no Heartbeat: {e}")
+        return False
+
+
 last_heartbeat_time = 0
+last_status = (None, 0.0)   # (estado gravado, quando)
 
 def update_status_and_heartbeat(state, driver, track, fuel_current, pos_g, pos_c=0, session_name=""):
-    global last_heartbeat_time
-    status_data = {
-        "state": state,
-        "driver": driver,
-        "track": track,
-        "last_update": time.time()
-    }
-    with open(STATUS_PATH, "w") as f:
-        json.dump(status_data, f)
+    global last_heartbeat_time, last_status
+    # Chamado a cada tick (até 60 Hz): o status.json só é regravado quando muda
+    # ou a cada STATUS_INTERVAL_S (o dashboard considera offline após 10 s).
+    if last_status[0] != (state, driver, track) or time.time() - last_status[1] >= STATUS_INTERVAL_S:
+        status_data = {
+            "state": state,
+            "driver": driver,
+            "track": track,
+            "last_update": time.time()
+        }
+        with open(STATUS_PATH, "w") as f:
+            json.dump(status_data, f)
+        last_status = ((state, driver, track), status_data["last_update"])
 
     if state != "offline" and (time.time() - last_heartbeat_time) > 2.0:
-        heartbeat = {
-            "Piloto":               driver,
-            "UserID":               -1,
-            "Volta":                0,
-            "Tempo":                0.0,
-            "Combustivel_Restante": float(fuel_current),
-            "Pos_Geral":            pos_g,
-            "Pos_Classe":           pos_c,
-            "Sessao":               session_name,   # FIX: sessão no heartbeat
-            "Timestamp":            time.strftime("%H:%M:%S"),
-            "state":                state
-        }
-        send_to_cloud(heartbeat)
+        send_presence(state, driver, fuel_current, pos_g, pos_c, session_name)
         last_heartbeat_time = time.time()
 
 
@@ -132,12 +155,11 @@ def get_session_type(session_num):
 last_valid_pos_g = 0
 last_valid_pos_c = 0
 
-def get_valid_position():
+def get_valid_position(tick, idx):
     global last_valid_pos_g, last_valid_pos_c
     try:
-        idx = ir['DriverInfo']['DriverCarIdx']
-        pos_g = ir['CarIdxPosition'][idx]
-        pos_c = ir['CarIdxClassPosition'][idx]
+        pos_g = tick['CarIdxPosition'][idx]
+        pos_c = tick['CarIdxClassPosition'][idx]
         if pos_g > 0:
             last_valid_pos_g = int(pos_g)
             last_valid_pos_c = int(pos_c)
@@ -150,7 +172,7 @@ def get_valid_position():
 # Controle Principal
 # ==============================
 last_session_num = -1
-last_recorded_lap_time = -1.0
+lap_closure = LapClosure()   # detecta e fecha a volta sem pausar o loop
 fuel_at_lap_start = -1.0
 file_initialized = False
 grid_recorded = False
@@ -163,7 +185,14 @@ DRIVING_GRACE_SECONDS = 10.0
 laps_window = deque(maxlen=WINDOW_SIZE)
 fuel_window = deque(maxlen=WINDOW_SIZE)
 
+# Variáveis lidas a cada tick, todas do mesmo frame (sampler.py)
+sampler = SdkSampler(ir, [
+    'FuelLevel', 'CarIdxLap', 'CarIdxPosition', 'CarIdxClassPosition', 'SessionNum',
+    'IsOnTrack', 'SessionState', 'LapLastLapTime', 'SessionLapsRemain', 'SessionTimeRemain',
+])
+
 print(f"📡 Telemetria Cloud Ativa — Enviando para: {SERVER_URL}\n")
+uplink.start()
 
 try:
     while True:
@@ -171,18 +200,21 @@ try:
             ir.startup()
             update_status_and_heartbeat("offline", "---", "---", 0.0, 0, 0)
             file_initialized = False
+            sampler.reset()
             time.sleep(1)
             continue
 
+        # Espera o próximo frame do iRacing e lê as variáveis de uma vez
+        tick = sampler.tick()
+
         car_idx = ir['DriverInfo']['DriverCarIdx']
         if car_idx < 0:
             update_status_and_heartbeat("connected", "Unknown", "---", 0.0, 0, 0)
-            time.sleep(0.5)
             continue
 
         # ===== DADOS ATUAIS =====
-        fuel_now = ir['FuelLevel']
-        pos_g, pos_c = get_valid_position()
+        fuel_now = tick['FuelLevel']
+        pos_g, pos_c = get_valid_position(tick, car_idx)
 
         try:
             driver_data    = ir['DriverInfo']['Drivers'][car_idx]
@@ -192,10 +224,10 @@ try:
         except:
             current_driver, current_user_id, team_name = "Unknown", -1, "N/A"
 
-        session_num  = ir['SessionNum']
+        session_num  = tick['SessionNum']
         session_name = get_session_type(session_num)
         track_name   = ir['WeekendInfo']['TrackDisplayName']
-        is_driving   = ir['IsOnTrack']
+        is_driving   = tick['IsOnTrack']
 
         if is_driving:
             last_on_track_time = time.time()
@@ -209,7 +241,7 @@ try:
             laps_window.clear()
             fuel_window.clear()
             grid_recorded = False
-            last_recorded_lap_time = -1.0
+            lap_closure.reset()
             fuel_at_lap_start = -1.0
             last_on_track_time = 0.0
             last_session_num = session_num
@@ -228,37 +260,42 @@ try:
             file_initialized = True
 
         # ===== GRID =====
-        if not grid_recorded and ir['SessionState'] == 4 and fuel_now > 0.5:
+        if not grid_recorded and tick['SessionState'] == 4 and fuel_now > 0.5:
             fuel_at_lap_start = fuel_now
             grid_recorded = True
             print(f"🟢 [GRID] {current_driver} alinhado com {fuel_now:.2f}L")
 
         # ===== DETECÇÃO DE VOLTA =====
-        lap_last_time = ir['LapLastLapTime']
-
-        if lap_last_time > 0 and lap_last_time != last_recorded_lap_time and recently_driving:
-
-            # Captura combustível ANTES do sleep (evita ler durante refuel)
-            fuel_before_sleep = ir['FuelLevel']
+        # A volta fica pendente quando LapLastLapTime muda e só é gravada depois
+        # que CarIdxLap/posição assentam; o loop segue amostrando nesse meio tempo.
+        sample = {
+            "car_lap": tick['CarIdxLap'][car_idx],
+            "pos_g":   pos_g,
+            "pos_c":   pos_c,
+            "fuel":    fuel_now,
+        }
+        closed = lap_closure.step(time.monotonic(), tick['LapLastLapTime'], sample,
+                                  allow_trigger=recently_driving)
 
-            time.sleep(1.5)  # Consolidação leve
+        if closed is not None:
+            lap_last_time = closed.lap_time
 
-            current_car_lap = ir['CarIdxLap'][car_idx] - 1.0
+            # Combustível no momento da detecção (antes de um possível refuel)
+            fuel_at_trigger = closed.fuel_at_trigger
 
-            driver_data    = ir['DriverInfo']['Drivers'][car_idx]
-            current_driver = driver_data.get('UserName', 'Unknown')
-            fuel_now       = ir['FuelLevel']
-            pos_g, pos_c   = get_valid_position()
+            current_car_lap = closed.sample["car_lap"] - 1.0
+            fuel_now        = closed.sample["fuel"]
+            pos_g, pos_c    = closed.sample["pos_g"], closed.sample["pos_c"]
 
-            if fuel_at_lap_start < 0 and fuel_before_sleep > 0.5:
-                fuel_at_lap_start = fuel_before_sleep
-                print(f"⛽ [INIT] fuel_at_lap_start inicializado: {fuel_before_sleep:.2f}L")
+            if fuel_at_lap_start < 0 and fuel_at_trigger > 0.5:
+                fuel_at_lap_start = fuel_at_trigger
+                print(f"⛽ [INIT] fuel_at_lap_start inicializado: {fuel_at_trigger:.2f}L")
 
             laps_window.append(lap_last_time)
             avg_lap_time = sum(laps_window) / len(laps_window)
 
-            session_laps_remain = ir['SessionLapsRemain']
-            session_time_remain = ir['SessionTimeRemain']
+            session_laps_remain = tick['SessionLapsRemain']
+            session_time_remain = tick['SessionTimeRemain']
             if session_laps_remain > 0 and session_laps_remain < 10000:
                 voltas_estimadas = session_laps_remain
             elif avg_lap_time > 0 and session_time_remain > 0:
@@ -267,12 +304,13 @@ try:
                 voltas_estimadas = 0
 
             # Detecção de reabastecimento: delta positivo acima do threshold
+            # (maior leitura durante a espera, não só a última)
             REFUEL_THRESHOLD   = 2.0
-            refuel_happened    = (fuel_now - fuel_before_sleep) > REFUEL_THRESHOLD
-            consumo_reference  = fuel_before_sleep
+            refuel_happened    = (closed.fuel_max - fuel_at_trigger) > REFUEL_THRESHOLD
+            consumo_reference  = fuel_at_trigger
 
             if refuel_happened:
-                print(f"⛽ [REFUEL] {fuel_at_lap_start:.1f}L → {fuel_before_sleep:.1f}L → {fuel_now:.1f}L")
+                print(f"⛽ [REFUEL] {fuel_at_lap_start:.1f}L → {fuel_at_trigger:.1f}L → {fuel_now:.1f}L")
 
             if fuel_at_lap_start > 0.1 and fuel_at_lap_start > consumo_reference:
                 consumo = max(0.0, fuel_at_lap_start - consumo_reference)
@@ -284,7 +322,7 @@ try:
             avg_fuel = sum(fuel_window) / len(fuel_window) if fuel_window else consumo
 
             data = {
-                "Timestamp":                   time.strftime("%H:%M:%S"),
+                "Timestamp":                   time.strftime("%H:%M:%S", time.localtime(closed.wall_time)),
                 "Sessao":                      session_name,
                 "Pista":                       track_name,
                 "Equipe":                      team_name,
@@ -308,17 +346,20 @@ try:
 
             # 2. Envia para Nuvem
             success = send_to_cloud(data)
-            status_cloud = "✅ Cloud OK" if success else "❌ Cloud Fail"
+            if not success:
+                status_cloud = "❌ Cloud Fail"
+            elif uplink.online:
+                status_cloud = f"📤 Cloud (fila: {uplink.pending})"
+            else:
+                status_cloud = f"🔌 Cloud offline (fila: {uplink.pending})"
             refuel_tag = " | ⛽ REFUEL" if refuel_happened else ""
             print(f"🏁 Volta {current_car_lap} | {current_driver} | {lap_last_time:.3f}s "
                   f"| Consumo: {consumo:.3f}L | P{pos_g} (Cls P{pos_c}){refuel_tag} | {status_cloud}")
 
-            last_recorded_lap_time = lap_last_time
             fuel_at_lap_start      = fuel_now
 
-        time.sleep(0.5)
-
 except KeyboardInterrupt:
     update_status_and_heartbeat("offline", "---", "---", 0.0, 0, 0)
 finally:
+    uplink.stop()
     ir.shutdown()
\ No newline at end of file
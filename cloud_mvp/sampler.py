@@ -0,0 +1,82 @@
+import time
+from config import SAMPLE_HZ, SAMPLE_REPORT_S
+
+# ==============================
+# Amostragem do SDK sincronizada com o iRacing
+# ==============================
+# Em vez de dormir um tempo fixo e ler cada variável com um ir[...] separado
+# (leituras de frames diferentes, 2–5 Hz com jitter), cada tick:
+#   1. espera o sinal de dados novos do iRacing (freeze_var_buffer_latest já
+#      aguarda o evento "data valid", até 32 ms — sem girar a CPU);
+#   2. congela o buffer de variáveis mais recente e lê todas as variáveis
+#      pedidas desse mesmo frame;
+#   3. descongela.
+# Com SAMPLE_HZ < 60 o intervalo entre ticks é respeitado com sleep antes da espera.
+# SessionTick (contador de frames do iRacing, 60/s) mede os ticks perdidos:
+# saltos maiores que o passo esperado (60 / SAMPLE_HZ).
+# Sem freeze_var_buffer_latest (pyirsdk antigo), cai para leitura direta com sleep.
+
+SIM_HZ = 60    # frequência de atualização da telemetria do iRacing
+
+
+class SdkSampler:
+    def __init__(self, ir, names, hz=SAMPLE_HZ, report_s=SAMPLE_REPORT_S):
+        self._ir = ir
+        self._names = list(dict.fromkeys([*names, 'SessionTick']))
+        self._hz = hz
+        self._interval = 1.0 / hz
+        self._step = max(1, round(SIM_HZ / hz))    # frames esperados entre dois ticks
+        self._report_s = report_s
+        self._synced = hasattr(ir, 'freeze_var_buffer_latest')
+        self._next_due = 0.0
+        self._last_tick = None
+        self._window_start = time.monotonic()
+        self._window_ticks = 0
+        self._window_missed = 0
+        self.ticks = 0
+        self.missed = 0
+        self.rate = 0.0
+
+    def reset(self):
+        """iRacing desconectado: o próximo SessionTick não é comparado com o anterior."""
+        self._last_tick = None
+
+    def tick(self):
+        """Espera o próximo frame e devolve {variável: valor}, tudo do mesmo frame."""
+        now = time.monotonic()
+        if now < self._next_due:
+            time.sleep(self._next_due - now)
+        start = time.monotonic()
+        ir = self._ir
+        if self._synced:
+            ir.freeze_var_buffer_latest()
+        try:
+            values = {name: ir[name] for name in self._names}
+        finally:
+            if self._synced:
+                ir.unfreeze_var_buffer_latest()
+        if self._synced:
+            # A espera pelo evento já alinha ao frame; meio frame de folga evita pular um.
+            self._next_due = time.monotonic() + self._interval - 0.5 / SIM_HZ
+        else:
+            self._next_due = start + self._interval
+        self._count(values['SessionTick'])
+        return values
+
+    def _count(self, session_tick):
+        self.ticks += 1
+        self._window_ticks += 1
+        if session_tick is not None:
+            if self._last_tick is not None and session_tick > self._last_tick:
+                lost = max(0, session_tick - self._last_tick - self._step)
+                self.missed += lost
+                self._window_missed += lost
+            self._last_tick = session_tick    # SessionTick menor = nova sessão/replay
+        now = time.monotonic()
+        elapsed = now - self._window_start
+        if elapsed >= self._report_s:
+            self.rate = self._window_ticks / elapsed
+            mode = "sincronizado com o iRacing" if self._synced else "sem sinal do iRacing (sleep)"
+            print(f"⏱️ SDK: {self.rate:.1f} Hz (alvo {self._hz}) | ticks perdidos: "
+                  f"{self._window_missed} (total {self.missed}) | {mode}")
+            self._window_start, self._window_ticks, self._window_missed = now, 0, 0
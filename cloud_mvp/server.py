@@ -1,46 +1,283 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-import sqlite3
-import os
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+import asyncio
+import json
+import time
+import zlib
+from typing import Optional
+from urllib.parse import quote
+from db import get_db, close_all, run_db
+from partitions import PartitionStore
+from writer import GroupCommitWriter
+from writer_service import RemoteWriter
+from stream import SessionNotifier, sse_event
+from encoding import negotiate_format, to_columns, encode, maybe_gzip
+from summary import compute_summary, SUMMARY_COLUMNS
+from derived import LapWindows, DERIVED_FIELDS
+from cache import SessionCache
+from presence import PresenceRegistry, PRESENCE_FIELDS, PRESENCE_UPSERT_SQL
+from archive import (
+    Archiver, archive_available, archive_path, export_session, delete_rows, read_rows, iter_rows,
+    reclaim_space,
+)
+from metrics import Counter, Gauge, Histogram, MetricsMiddleware, render_all
+from export import EXPORT_FORMATS, StreamWriter, arrow_schema, export_available
+from contextlib import contextmanager
+from email.utils import formatdate
+from config import (
+    MAX_BATCH_RECORDS, MAX_BATCH_BYTES, WRITER_ACK_TIMEOUT_S, STREAM_KEEPALIVE_S,
+    SESSION_PAGE_DEFAULT, SESSION_PAGE_MAX, STORAGE_MODE, ARCHIVE_CHUNK_ROWS, EXPORT_CHUNK_ROWS,
+    WRITER_MODE,
+)
 
 app = FastAPI()
-DB_PATH = 'telemetry.db'
+app.add_middleware(MetricsMiddleware)
 
-# ─── Cria o banco de dados se não existir ───────────────
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# ─── Schema da tabela de voltas ─────────────────────────
+TELEMETRY_DDL = '''
+    CREATE TABLE IF NOT EXISTS telemetry (
+        id             INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id     TEXT,
+        driver         TEXT,
+        user_id        INTEGER,
+        lap            INTEGER,
+        lap_time       REAL,
+        fuel           REAL,
+        position       INTEGER,
+        class_position INTEGER DEFAULT 0,
+        session_type   TEXT    DEFAULT 'Race',
+        timestamp      TEXT,
+        state          TEXT,
+        client_ms      INTEGER,
+        received_ms    INTEGER,
+        avg_lap_3      REAL,
+        fuel_used      REAL,
+        avg_fuel_3     REAL
+    )
+'''
+
+# Colunas adicionadas depois da primeira versão: (nome, tipo/default).
+TELEMETRY_ADDED_COLUMNS = [
+    ('class_position', 'INTEGER DEFAULT 0'),
+    ('session_type',   "TEXT DEFAULT 'Race'"),
+    ('client_ms',      'INTEGER'),     # relógio do piloto (epoch ms), se enviado
+    ('received_ms',    'INTEGER'),     # relógio do servidor no commit (epoch ms)
+    ('avg_lap_3',      'REAL'),        # métricas derivadas no ingest (derived.py)
+    ('fuel_used',      'REAL'),
+    ('avg_fuel_3',     'REAL'),
+]
+
+def migrate_telemetry(db):
+    """Migração automática: adiciona as colunas que faltarem em bancos antigos.
+    Necessário para ambientes sem acesso ao shell (ex: Render free tier)."""
+    existing_cols = [row[1] for row in db.execute('PRAGMA table_info(telemetry)').fetchall()]
+    for name, decl in TELEMETRY_ADDED_COLUMNS:
+        if name not in existing_cols:
+            db.execute(f'ALTER TABLE telemetry ADD COLUMN {name} {decl}')
+
+# Uma volta é identificada por (sessão, piloto, volta, tipo de sessão).
+LAP_KEY = 'session_id, user_id, lap, session_type'
+
+TELEMETRY_INDEXES = [
+    # Índice composto: /session/{id}?since_id= vira um range scan em vez de full scan.
+    'CREATE INDEX IF NOT EXISTS idx_telemetry_session_id ON telemetry (session_id, id)',
+    # Índice do resumo (/session/{id}/summary): última linha e voltas por piloto.
+    'CREATE INDEX IF NOT EXISTS idx_telemetry_session_driver '
+    'ON telemetry (session_id, session_type, driver, id)',
+    # Janelas de tempo (?from=&to=) pelo relógio do servidor.
+    'CREATE INDEX IF NOT EXISTS idx_telemetry_session_received '
+    'ON telemetry (session_id, received_ms)',
+]
+LAP_KEY_INDEX = f'CREATE UNIQUE INDEX IF NOT EXISTS idx_telemetry_lap_key ON telemetry ({LAP_KEY})'
+
+def create_telemetry_schema(db):
+    """Schema completo de um arquivo de sessão (novo ou de versão anterior)."""
+    db.execute(TELEMETRY_DDL)
+    migrate_telemetry(db)
+    for sql in TELEMETRY_INDEXES + [LAP_KEY_INDEX]:
+        db.execute(sql)
+
+# ─── Modo de armazenamento (ver partitions.py) ──────────
+partitions = PartitionStore(create_telemetry_schema) if STORAGE_MODE == 'session' else None
 
+@contextmanager
+def session_db(session_id, create=False):
+    """Conexão que guarda as voltas da sessão: o banco principal no modo
+    'shared', o arquivo da sessão no modo 'session'. Sem `create`, sessão sem
+    arquivo lê do banco principal (tabela vazia com o mesmo schema)."""
+    if partitions is None or not (create or partitions.exists(session_id)):
+        yield get_db()
+    else:
+        with partitions.connection(session_id) as db:
+            yield db
+
+# ─── Cria o banco de dados se não existir ───────────────
+# No modo 'remote' o schema, as migrações e a presença inicial são do processo
+# escritor; o worker carrega a presença quando conecta (ver apply_event).
 @app.on_event('startup')
 def init_db():
+    if WRITER_MODE == 'remote':
+        return
     db = get_db()
+    db.execute(TELEMETRY_DDL)
+    migrate_telemetry(db)
+    for sql in TELEMETRY_INDEXES:
+        db.execute(sql)
+
+    # Catálogo de sessões, mantido no ingest: /sessions não varre mais a telemetria.
+    catalog_exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sessions'"
+    ).fetchone()
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id  TEXT PRIMARY KEY,
+            first_seen  REAL,
+            last_seen   REAL,
+            row_count   INTEGER DEFAULT 0,
+            archived_max_id INTEGER DEFAULT 0,
+            max_id      INTEGER DEFAULT 0
+        )
+    ''')
     db.execute('''
-        CREATE TABLE IF NOT EXISTS telemetry (
-            id             INTEGER PRIMARY KEY AUTOINCREMENT,
+        CREATE TABLE IF NOT EXISTS session_drivers (
+            session_id  TEXT,
+            driver      TEXT,
+            PRIMARY KEY (session_id, driver)
+        ) WITHOUT ROWID
+    ''')
+    # Migração automática: bancos antigos não têm o catálogo, então ele é
+    # reconstruído uma única vez a partir da telemetria existente.
+    if not catalog_exists:
+        now = time.time()
+        db.execute(
+            'INSERT INTO sessions (session_id, first_seen, last_seen, row_count, max_id) '
+            'SELECT session_id, ?, ?, COUNT(*), MAX(id) FROM telemetry GROUP BY session_id',
+            (now, now)
+        )
+        db.execute(
+            'INSERT OR IGNORE INTO session_drivers (session_id, driver) '
+            'SELECT DISTINCT session_id, driver FROM telemetry'
+        )
+    # Migração automática: linhas com id <= archived_max_id estão no Parquet (archive.py).
+    catalog_cols = [row[1] for row in db.execute('PRAGMA table_info(sessions)').fetchall()]
+    if 'archived_max_id' not in catalog_cols:
+        db.execute('ALTER TABLE sessions ADD COLUMN archived_max_id INTEGER DEFAULT 0')
+    # Migração automática: max_id (último id gravado) deixa o arquivador decidir
+    # sem consultar a telemetria, que pode estar em arquivos por sessão.
+    if 'max_id' not in catalog_cols:
+        db.execute('ALTER TABLE sessions ADD COLUMN max_id INTEGER DEFAULT 0')
+        db.execute(
+            'UPDATE sessions SET max_id = MAX(archived_max_id, '
+            '(SELECT COALESCE(MAX(id), 0) FROM telemetry t WHERE t.session_id = sessions.session_id))'
+        )
+
+    # Presença (heartbeats): último estado por piloto, fora da tabela de voltas.
+    presence_exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='presence'"
+    ).fetchone()
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS presence (
             session_id     TEXT,
             driver         TEXT,
-            user_id        INTEGER,
-            lap            INTEGER,
-            lap_time       REAL,
+            state          TEXT,
             fuel           REAL,
             position       INTEGER,
-            class_position INTEGER DEFAULT 0,
-            session_type   TEXT    DEFAULT 'Race',
+            class_position INTEGER,
+            session_type   TEXT,
             timestamp      TEXT,
-            state          TEXT
-        )
+            last_seen      REAL,
+            PRIMARY KEY (session_id, driver)
+        ) WITHOUT ROWID
     ''')
-    # Migração automática: adiciona class_position se o banco já existia sem ela.
-    # Necessário para ambientes sem acesso ao shell (ex: Render free tier).
-    existing_cols = [
-        row[1] for row in db.execute('PRAGMA table_info(telemetry)').fetchall()
-    ]
-    if 'class_position' not in existing_cols:
-        db.execute('ALTER TABLE telemetry ADD COLUMN class_position INTEGER DEFAULT 0')
-    if 'session_type' not in existing_cols:
-        db.execute("ALTER TABLE telemetry ADD COLUMN session_type TEXT DEFAULT 'Race'")
+    # Migração automática: heartbeats antigos (UserID=-1, Volta=0) viram presença
+    # (mantém só o mais recente de cada piloto) e saem da tabela de voltas.
+    # last_seen é o horário de recebimento original (0 se desconhecido): pilotos
+    # antigos não aparecem como ao vivo logo após a atualização.
+    if not presence_exists:
+        db.execute(
+            f"INSERT OR REPLACE INTO presence ({', '.join(PRESENCE_FIELDS)}) "
+            'SELECT session_id, driver, state, fuel, position, class_position, '
+            '       session_type, timestamp, COALESCE(received_ms / 1000.0, 0) '
+            f'FROM telemetry WHERE id IN (SELECT MAX(id) FROM telemetry WHERE {HEARTBEAT_WHERE} '
+            '                            GROUP BY session_id, driver)'
+        )
+        db.execute(f'DELETE FROM telemetry WHERE {HEARTBEAT_WHERE}')
+        db.execute(
+            'UPDATE sessions SET row_count = '
+            '(SELECT COUNT(*) FROM telemetry t WHERE t.session_id = sessions.session_id)'
+        )
+    # Chave de idempotência: reenvio após timeout ou colegas no mesmo carro
+    # mandando a mesma volta viram um conflito barato em vez de linhas extras.
+    # Migração automática: antes de criar o índice, mantém só a primeira cópia
+    # de cada volta e desconta as duplicatas do catálogo.
+    lap_key_exists = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_telemetry_lap_key'"
+    ).fetchone()
+    if not lap_key_exists:
+        duplicates = db.execute(
+            'SELECT session_id, COUNT(*) FROM telemetry WHERE id NOT IN ('
+            f'  SELECT MIN(id) FROM telemetry GROUP BY {LAP_KEY}'
+            ') GROUP BY session_id'
+        ).fetchall()
+        if duplicates:
+            db.execute(
+                'DELETE FROM telemetry WHERE id NOT IN ('
+                f'  SELECT MIN(id) FROM telemetry GROUP BY {LAP_KEY})'
+            )
+            db.executemany(
+                'UPDATE sessions SET row_count = MAX(row_count - ?, 0) WHERE session_id = ?',
+                [(n, session_id) for session_id, n in duplicates]
+            )
+        db.execute(LAP_KEY_INDEX)
     db.commit()
+    presence.load(db.execute('SELECT * FROM presence'))
+    if partitions is not None:
+        move_to_partitions(db)
+
+    # auto_vacuum incremental permite devolver ao disco o espaço das sessões
+    # arquivadas; em bancos antigos só passa a valer após um VACUUM (uma vez).
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        db.execute('VACUUM')
+
+# Migração automática para o modo 'session': as voltas que estão na tabela
+# compartilhada vão para o arquivo de cada sessão (mesmos ids), em blocos.
+def move_to_partitions(db):
+    sessions = [r[0] for r in db.execute('SELECT DISTINCT session_id FROM telemetry')]
+    if not sessions:
+        return
+    names = [c[1] for c in db.execute('PRAGMA table_info(telemetry)')]
+    insert = (
+        f"INSERT OR IGNORE INTO telemetry ({', '.join(names)}) "
+        f"VALUES ({', '.join('?' * len(names))})"
+    )
+    for session_id in sessions:
+        print(f"🗂️ Movendo a sessão '{session_id}' para {partitions.path(session_id)}")
+        with partitions.connection(session_id) as pdb:
+            cursor = 0
+            while True:
+                rows = db.execute(
+                    'SELECT * FROM telemetry WHERE session_id=? AND id>? ORDER BY id LIMIT ?',
+                    (session_id, cursor, ARCHIVE_CHUNK_ROWS)
+                ).fetchall()
+                if not rows:
+                    break
+                with pdb:
+                    pdb.executemany(insert, [tuple(r) for r in rows])
+                cursor = rows[-1]['id']
+        delete_rows(db, session_id)
+    reclaim_space(db)
+
+# ─── Fecha as conexões do pool ao desligar ──────────────
+# O writer grava o que ainda está na fila antes de o pool ser fechado.
+@app.on_event('shutdown')
+def close_db():
+    archiver.stop()
+    writer.stop()
+    if partitions is not None:
+        partitions.close_all()
+    close_all()
 
 # ─── Modelo de dados ────────────────────────────────────
 class TelemetryData(BaseModel):
@@ -55,54 +292,666 @@ class TelemetryData(BaseModel):
     session_type:   str = 'Race'   # FIX: Practice / Qualify / Race
     timestamp:      str
     state:          str
+    client_ms:      Optional[int] = None   # epoch ms do piloto (latência ponta a ponta)
+
+class PresenceData(BaseModel):
+    session_id:     str
+    driver:         str
+    state:          str
+    fuel:           float = 0.0
+    position:       int = 0
+    class_position: int = 0
+    session_type:   str = 'Race'
+    timestamp:      str = ''
+
+# Heartbeat no formato antigo (enviado como telemetria): sem volta e sem tempo.
+HEARTBEAT_WHERE = 'user_id = -1 AND lap = 0 AND lap_time = 0'
+
+def is_heartbeat(d):
+    return d.user_id == -1 and d.lap == 0 and d.lap_time == 0
+
+presence = PresenceRegistry()
+
+def record_presence(data):
+    """Atualiza o registro em memória e devolve a linha a ser persistida."""
+    entry = {
+        'session_id':     data.session_id,
+        'driver':         data.driver,
+        'state':          data.state,
+        'fuel':           data.fuel,
+        'position':       data.position,
+        'class_position': data.class_position,
+        'session_type':   data.session_type,
+        'timestamp':      data.timestamp,
+        'last_seen':      time.time(),
+    }
+    presence.update(entry)
+    return entry
+
+INSERT_SQL = (
+    'INSERT INTO telemetry (session_id, driver, user_id, lap, lap_time, fuel, '
+    'position, class_position, session_type, timestamp, state, client_ms, received_ms, '
+    f"{', '.join(DERIVED_FIELDS)}) "
+    'VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) '
+    f'ON CONFLICT({LAP_KEY}) DO NOTHING'
+)
+
+CATALOG_UPSERT_SQL = (
+    'INSERT INTO sessions (session_id, first_seen, last_seen, row_count, max_id) VALUES (?,?,?,?,?) '
+    'ON CONFLICT(session_id) DO UPDATE SET '
+    'last_seen=excluded.last_seen, row_count=row_count+excluded.row_count, '
+    'max_id=MAX(max_id, excluded.max_id)'
+)
+
+def update_catalog(db, records, row_ids):
+    """Atualiza o catálogo de sessões (contagem, último registro/id, pilotos)."""
+    now = time.time()
+    counts, max_ids, drivers = {}, {}, set()
+    for d in records:
+        counts[d.session_id] = counts.get(d.session_id, 0) + 1
+        max_ids[d.session_id] = max(max_ids.get(d.session_id, 0), row_ids[id(d)])
+        drivers.add((d.session_id, d.driver))
+    db.executemany(CATALOG_UPSERT_SQL, [
+        (session_id, now, now, n, max_ids[session_id]) for session_id, n in counts.items()
+    ])
+    db.executemany(
+        'INSERT OR IGNORE INTO session_drivers (session_id, driver) VALUES (?,?)',
+        drivers
+    )
+
+_last_received_ms = 0
+
+def receive_clock_ms():
+    """Epoch ms do servidor, nunca decrescente (o relógio do sistema pode voltar).
+    Só é chamado pela thread do writer."""
+    global _last_received_ms
+    _last_received_ms = max(int(time.time() * 1000), _last_received_ms)
+    return _last_received_ms
+
+def archived_laps(session_id, session_type, driver, lap):
+    """Voltas válidas arquivadas do piloto antes de `lap` (para montar a janela de derived.py)."""
+    amax = archived_max_id(session_id)
+    if not amax:
+        return []
+    rows = read_rows(session_id, ('lap', 'lap_time', 'fuel'), 0, amax, where=[
+        ('session_type', '==', session_type), ('driver', '==', driver),
+        ('lap_time', '>', 0), ('lap', '<', lap),
+    ])
+    return [tuple(r) for r in rows]
+
+lap_windows = LapWindows(archived_laps)
+
+def insert_laps(db, laps, row_ids, received_ms):
+    """Insere as voltas (com as métricas derivadas) e anota em `row_ids` o id das
+    que não eram duplicatas. Uma execução por volta (e não executemany) para saber
+    quais conflitaram — e para a janela só avançar com voltas inseridas."""
+    for d in laps:
+        derived = lap_windows.derive(db, d)
+        cur = db.execute(INSERT_SQL, (
+            d.session_id, d.driver, d.user_id, d.lap,
+            d.lap_time, d.fuel, d.position, d.class_position,
+            d.session_type, d.timestamp, d.state, d.client_ms, received_ms, *derived
+        ))
+        if cur.rowcount:
+            row_ids[id(d)] = cur.lastrowid
+            lap_windows.commit(d, derived)
+            if d.client_ms:
+                ingest_latency.observe(max(0, received_ms - d.client_ms) / 1000)
+
+def insert_records(records):
+    """Grava telemetria (TelemetryData) e presença (dicts de record_presence)
+    numa única transação (um único commit). No modo 'session' cada arquivo de
+    sessão tem o próprio commit, antes do commit do catálogo.
+
+    Retorna um resultado por registro: False para voltas que já existiam
+    (duplicatas suprimidas pelo índice único), True para o resto."""
+    laps = [r for r in records if isinstance(r, TelemetryData)]
+    beats = [r for r in records if isinstance(r, dict)]
+    db = get_db()
+    row_ids = {}
+    received_ms = receive_clock_ms()
+    try:
+        with commit_seconds.time():
+            if partitions is not None:
+                by_session = {}
+                for d in laps:
+                    by_session.setdefault(d.session_id, []).append(d)
+                for session_id, group in by_session.items():
+                    with session_db(session_id, create=True) as sdb, sdb:
+                        insert_laps(sdb, group, row_ids, received_ms)
+            # `with db` faz commit ou rollback: a conexão é reaproveitada, então
+            # não pode ficar com transação pendurada após um erro.
+            with db:
+                if partitions is None:
+                    insert_laps(db, laps, row_ids, received_ms)
+                new_laps = [d for d in laps if id(d) in row_ids]
+                if new_laps:
+                    update_catalog(db, new_laps, row_ids)
+                if beats:
+                    db.executemany(PRESENCE_UPSERT_SQL, [
+                        tuple(b[f] for f in PRESENCE_FIELDS) for b in beats
+                    ])
+    except Exception:
+        # As janelas podem ter avançado com voltas que sofreram rollback.
+        for session_id in {d.session_id for d in laps}:
+            lap_windows.forget(session_id)
+        raise
+    rows_committed.inc(len(new_laps), kind='lap')
+    rows_committed.inc(len(laps) - len(new_laps), kind='duplicate')
+    rows_committed.inc(len(beats), kind='presence')
+    session_ids = {d.session_id for d in new_laps}
+    if session_ids:
+        hot_cache.on_insert(session_ids)
+        notifier.notify(session_ids)
+    if session_ids or beats:
+        publish('committed', session_ids, beats)
+    return [not isinstance(r, TelemetryData) or id(r) in row_ids for r in records]
+
+# ─── Escritor único com group commit ────────────────────
+# Modo 'local': o writer roda neste processo. Modo 'remote' (vários workers do
+# uvicorn): as gravações vão para o processo de writer_service.py, que avisa
+# todos os workers depois de cada commit para atualizarem cache, SSE e presença.
+notifier = SessionNotifier()
+event_listeners = []   # preenchido pelo writer_service no processo escritor
+
+def publish(event, *args):
+    for listener in event_listeners:
+        listener(event, *args)
+
+def apply_event(event, *args):
+    """Eventos do processo escritor, recebidos por um worker no modo 'remote'."""
+    if event == 'committed':
+        session_ids, beats = args
+        for entry in beats:
+            presence.update(entry)
+        if session_ids:
+            hot_cache.on_insert(session_ids)
+            notifier.notify(session_ids)
+    elif event == 'dropped':
+        session_id, = args
+        if partitions is not None:
+            partitions.release(session_id)
+        hot_cache.invalidate(session_id)
+        presence.drop(session_id)
+    elif event == 'connected':
+        # Eventos podem ter se perdido enquanto o escritor estava fora.
+        hot_cache.expire_all()
+        presence.load(get_db().execute('SELECT * FROM presence'))
+
+if WRITER_MODE == 'remote':
+    writer = RemoteWriter(apply_event)
+else:
+    writer = GroupCommitWriter(insert_records)
+
+@app.on_event('startup')
+def start_writer():
+    writer.start()
+
+async def write_and_wait(records):
+    """Enfileira no writer e espera o commit sem ocupar thread nenhuma."""
+    try:
+        return await asyncio.wait_for(
+            asyncio.wrap_future(writer.submit(records)), WRITER_ACK_TIMEOUT_S
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail='Telemetry writer timed out')
+    except ConnectionError:
+        raise HTTPException(status_code=503, detail='Telemetry writer unavailable')
 
 # ─── Recebe telemetria dos pilotos ──────────────────────
+# A resposta só sai depois que o grupo contendo o registro foi commitado.
+# Heartbeats de clientes antigos (UserID=-1, Volta=0) vão para a presença.
 @app.post('/telemetry')
-def receive_telemetry(data: TelemetryData):
-    db = get_db()
-    db.execute(
-        'INSERT INTO telemetry VALUES (NULL,?,?,?,?,?,?,?,?,?,?,?)',
-        (data.session_id, data.driver, data.user_id, data.lap,
-         data.lap_time, data.fuel, data.position, data.class_position,
-         data.session_type, data.timestamp, data.state)
-    )
-    db.commit()
+async def receive_telemetry(data: TelemetryData):
+    if is_heartbeat(data):
+        writer.submit([record_presence(data)])
+        return {'status': 'ok'}
+    inserted, = await write_and_wait([data])
+    return {'status': 'ok', 'duplicate': not inserted}
+
+# ─── Recebe heartbeat / presença dos pilotos ────────────
+# O estado já vale para leitura ao sair daqui; a persistência vai no próximo
+# grupo do writer, sem a requisição esperar pelo commit.
+@app.post('/presence')
+async def receive_presence(data: PresenceData):
+    writer.submit([record_presence(data)])
     return {'status': 'ok'}
 
+# ─── Recebe um lote de telemetria (uma transação) ───────
+# Corpo: lista JSON de TelemetryData, opcionalmente com Content-Encoding: gzip.
+# Registros inválidos são rejeitados individualmente; os válidos são gravados.
+# O gzip é descomprimido com teto de MAX_BATCH_BYTES (413 acima disso): um corpo
+# pequeno que expande para gigabytes não chega a ocupar a memória.
+def gunzip_limited(body, max_bytes):
+    decompressor = zlib.decompressobj(wbits=31)   # 31: formato gzip (cabeçalho + CRC)
+    try:
+        data = decompressor.decompress(body, max_bytes + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail='Invalid gzip body')
+    if len(data) > max_bytes:
+        raise HTTPException(status_code=413, detail=f'Batch too large (max {max_bytes} bytes)')
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail='Invalid gzip body')
+    return data
+
+@app.post('/telemetry/batch')
+async def receive_telemetry_batch(request: Request):
+    body = await request.body()
+    if len(body) > MAX_BATCH_BYTES:
+        raise HTTPException(status_code=413, detail=f'Batch too large (max {MAX_BATCH_BYTES} bytes)')
+    if request.headers.get('content-encoding', '').lower() == 'gzip':
+        body = gunzip_limited(body, MAX_BATCH_BYTES)
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid JSON body')
+    if not isinstance(payload, list):
+        raise HTTPException(status_code=422, detail='Expected a JSON array of telemetry records')
+    if len(payload) > MAX_BATCH_RECORDS:
+        raise HTTPException(status_code=413, detail=f'Batch too large (max {MAX_BATCH_RECORDS} records)')
+
+    valid, results, valid_results = [], [], []
+    for idx, item in enumerate(payload):
+        try:
+            valid.append(TelemetryData.model_validate(item))
+            results.append({'index': idx, 'status': 'ok'})
+            valid_results.append(results[-1])
+        except ValidationError as e:
+            detail = '; '.join(
+                f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()
+            )
+            results.append({'index': idx, 'status': 'error', 'detail': detail})
+
+    valid = [record_presence(d) if is_heartbeat(d) else d for d in valid]
+    duplicates = 0
+    if valid:
+        inserted = await write_and_wait(valid)
+        for result, ok in zip(valid_results, inserted):
+            if not ok:
+                result['status'] = 'duplicate'
+                duplicates += 1
+    return {
+        'status':     'ok',
+        'inserted':   len(valid) - duplicates,
+        'duplicates': duplicates,
+        'rejected':   len(payload) - len(valid),
+        'results':    results,
+    }
+
+# ─── Leitura incremental de uma sessão ──────────────────
+# Sessões arquivadas: linhas com id <= archived_max_id vêm do Parquet, as
+# posteriores do SQLite — a leitura é transparente para os endpoints.
+def archived_max_id(session_id):
+    row = get_db().execute(
+        'SELECT archived_max_id FROM sessions WHERE session_id=?', (session_id,)
+    ).fetchone()
+    return (row[0] or 0) if row else 0
+
+def received_filter(received):
+    """Trecho SQL e parâmetros para received=(from_ms, to_ms), pontas opcionais."""
+    sql, params = '', []
+    if received is not None:
+        for op, value in zip(('>=', '<='), received):
+            if value is not None:
+                sql += f' AND received_ms {op} ?'
+                params.append(value)
+    return sql, params
+
+def _live_rows(session_id, since_id, limit, tail=False, received=None):
+    order = 'DESC' if tail else 'ASC'
+    where, params = received_filter(received)
+    with session_db(session_id) as db:
+        cur = db.execute(
+            f'SELECT * FROM (SELECT * FROM telemetry WHERE session_id=? AND id>?{where} '
+            f'ORDER BY id {order} LIMIT ?) ORDER BY id',
+            (session_id, since_id, *params, limit)
+        )
+        rows = cur.fetchall()
+    return [c[0] for c in cur.description], rows
+
+def query_page(session_id, since_id=0, limit=SESSION_PAGE_MAX, received=None):
+    """Retorna (nomes_das_colunas, linhas) sem montar um dict por linha.
+    `received=(from_ms, to_ms)` restringe à janela de recebimento no servidor."""
+    amax = archived_max_id(session_id)
+    names, rows = _live_rows(session_id, max(since_id, amax), limit, received=received)
+    if since_id < amax:
+        archived = read_rows(session_id, names, since_id, amax, limit, received=received)
+        rows = archived + rows[:limit - len(archived)]
+    return names, rows
+
+def query_tail(session_id, since_id, n):
+    """Últimas `n` linhas com id > since_id, em ordem crescente (carga do cache)."""
+    amax = archived_max_id(session_id)
+    names, rows = _live_rows(session_id, max(since_id, amax), n, tail=True)
+    if len(rows) < n and since_id < amax:
+        rows = read_rows(session_id, names, since_id, amax, n - len(rows), tail=True) + rows
+    return names, rows
+
+def query_meta(session_id):
+    """(row_count, last_seen, geração) do catálogo. A geração é o first_seen em ms:
+    muda quando a sessão é apagada e recriada, mesmo que os ids se repitam."""
+    row = get_db().execute(
+        'SELECT row_count, last_seen, first_seen FROM sessions WHERE session_id=?', (session_id,)
+    ).fetchone()
+    if row is None:
+        return 0, None, 0
+    return row['row_count'], row['last_seen'], int((row['first_seen'] or 0) * 1000)
+
+hot_cache = SessionCache(query_tail, query_meta)
+
+def fetch_rows(session_id, since_id=0, limit=SESSION_PAGE_MAX):
+    """(geração, linhas após since_id): memória quando possível, banco quando o
+    trecho saiu do cache."""
+    meta, page = hot_cache.read(session_id, since_id, limit)
+    _, rows = page if page is not None else query_page(session_id, since_id, limit)
+    return meta[3], [dict(r) for r in rows]
+
+# ─── Exportação em massa (Parquet / Arrow IPC) ──────────
+# Registradas antes de /session/{session_id}, que também casaria com "x.parquet".
+# A sessão sai em blocos (ver export.py): leitura e serialização de cada bloco
+# rodam no executor de operações pesadas, sem ocupar as threads de leitura.
+def export_columns():
+    return [(r['name'], r['type']) for r in get_db().execute('PRAGMA table_info(telemetry)')]
+
+async def export_response(session_id, fmt, from_ms, to_ms):
+    if not export_available():
+        raise HTTPException(status_code=503, detail='Export requires pyarrow')
+    if await run_db(catalog_entry, session_id) is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    received = (from_ms, to_ms) if from_ms is not None or to_ms is not None else None
+    schema = arrow_schema(await run_db(export_columns))
+
+    async def chunks():
+        writer = StreamWriter(fmt, schema)
+        # Trecho arquivado: lido do Parquet um record batch por vez (iter_rows),
+        # sem refiltrar o arquivo a cada bloco.
+        cursor = await run_db(archived_max_id, session_id)
+        if cursor:
+            archived = iter_rows(session_id, cursor, EXPORT_CHUNK_ROWS, received)
+            while (chunk := await run_db(next, archived, None, bulk=True)) is not None:
+                yield await run_db(writer.write, *chunk, bulk=True)
+        while True:
+            names, rows = await run_db(_live_rows, session_id, cursor, EXPORT_CHUNK_ROWS,
+                                       received=received, bulk=True)
+            if not rows:
+                break
+            yield await run_db(writer.write, names, rows, bulk=True)
+            cursor = rows[-1]['id']
+        yield writer.close()
+
+    filename = quote(f'{session_id}.{fmt}', safe='')
+    headers = {'Content-Disposition': f"attachment; filename*=UTF-8''{filename}"}
+    return StreamingResponse(chunks(), media_type=EXPORT_FORMATS[fmt], headers=headers)
+
+@app.get('/session/{session_id}.parquet')
+async def export_parquet(session_id: str, from_ms: int = Query(None, alias='from'),
+                         to_ms: int = Query(None, alias='to')):
+    return await export_response(session_id, 'parquet', from_ms, to_ms)
+
+@app.get('/session/{session_id}.arrow')
+async def export_arrow(session_id: str, from_ms: int = Query(None, alias='from'),
+                       to_ms: int = Query(None, alias='to')):
+    return await export_response(session_id, 'arrow', from_ms, to_ms)
+
 # ─── Retorna dados da sessão (com paginação) ────────────
+# Página de até `limit` linhas (teto SESSION_PAGE_MAX) após `since_id`; o cliente
+# continua de `next_since_id` enquanto `has_more` for verdadeiro.
+# O ETag muda a cada linha nova: If-None-Match com o mesmo valor recebe 304.
+# `generation` muda quando a sessão é apagada e recriada (os ids recomeçam): o
+# cliente que a vê mudar descarta o que tinha e recomeça de since_id=0.
+# Formato negociado por Accept (ou ?format=rows|columns|msgpack), ver encoding.py;
+# nos formatos colunares as linhas vêm em `columns` em vez de `rows`.
+# ?from=&to= (epoch ms, inclusivos) filtram por received_ms, o relógio do servidor;
+# a paginação por since_id continua valendo dentro da janela.
 @app.get('/session/{session_id}')
-def get_session(session_id: str, since_id: int = 0):
+async def get_session(session_id: str, request: Request,
+                      since_id: int = 0, limit: int = SESSION_PAGE_DEFAULT, format: str = None,
+                      from_ms: int = Query(None, alias='from'), to_ms: int = Query(None, alias='to')):
+    # Leitura, serialização e gzip rodam juntos numa thread de leitura do banco.
+    received = (from_ms, to_ms) if from_ms is not None or to_ms is not None else None
+    return await run_db(session_response, session_id, request.headers, since_id, limit, format,
+                        received)
+
+def session_response(session_id, request_headers, since_id, limit, format, received=None):
+    limit = max(1, min(limit, SESSION_PAGE_MAX))
+    fmt = negotiate_format(request_headers.get('accept'), format)
+    (max_id, row_count, last_seen, generation), page = hot_cache.read(session_id, since_id, limit + 1)
+    if received is not None:
+        page = None   # o cache guarda só o fim da sessão, sem filtro de tempo
+    etag = f'W/"{generation}-{max_id}-{row_count}-{fmt}"'
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept, Accept-Encoding'}
+    if last_seen is not None:
+        headers['Last-Modified'] = formatdate(last_seen, usegmt=True)
+    if etag in [t.strip() for t in request_headers.get('if-none-match', '').split(',')]:
+        return Response(status_code=304, headers=headers)
+
+    names, rows = page if page is not None else query_page(session_id, since_id, limit + 1, received)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    payload = {
+        'next_since_id': rows[-1]['id'] if rows else since_id,
+        'has_more':      has_more,
+        'max_id':        max_id,
+        'generation':    generation,
+    }
+    if fmt == 'rows':
+        payload['rows'] = [dict(r) for r in rows]
+    else:
+        payload['columns'] = to_columns(names, rows)
+
+    body, media_type = encode(payload, fmt)
+    body, gzip_headers = maybe_gzip(body, request_headers.get('accept-encoding'))
+    headers.update(gzip_headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+# ─── Presença dos pilotos (semáforo do dashboard) ───────
+@app.get('/session/{session_id}/presence')
+async def get_presence(session_id: str):
+    return presence.get(session_id)
+
+# ─── Resumo da sessão (métricas principais, calculado no SQL) ─
+# Poucas centenas de bytes com stints, melhor volta, médias e consumo por piloto,
+# em vez de baixar a sessão inteira para recalcular no pandas.
+def summarize(session_id, session_type=None, driver=None):
+    amax = archived_max_id(session_id)
+    archived = read_rows(session_id, SUMMARY_COLUMNS, 0, amax) if amax else []
+    with session_db(session_id) as db:
+        return compute_summary(db, session_id, session_type, driver=driver,
+                               presence=presence.get(session_id), archived=archived)
+
+@app.get('/session/{session_id}/summary')
+async def get_session_summary(session_id: str, session_type: str = None):
+    summary = await run_db(summarize, session_id, session_type)
+    if summary is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    return summary
+
+@app.get('/session/{session_id}/summary/{driver}')
+async def get_driver_summary(session_id: str, driver: str, session_type: str = None):
+    summary = await run_db(summarize, session_id, session_type, driver)
+    if summary is None or driver not in summary['drivers']:
+        raise HTTPException(status_code=404, detail=f"Driver '{driver}' not found in session '{session_id}'")
+    return summary
+
+# ─── Stream ao vivo da sessão (Server-Sent Events) ──────
+# Envia as linhas com id > since_id e depois cada novo lote assim que é
+# commitado: evento 'rows' com {"generation": g, "rows": [...]}. Reconexões
+# retomam do cabeçalho Last-Event-ID ("geração-id da última linha").
+# Se a geração mudar (sessão apagada e recriada, ids recomeçam) — durante o
+# stream ou em relação à informada por ?generation= / Last-Event-ID — o cursor
+# volta a 0 e o cliente deve descartar o que tinha.
+@app.get('/session/{session_id}/stream')
+async def stream_session(session_id: str, request: Request, since_id: int = 0,
+                         generation: int = None):
+    generation_id, _, last_id = request.headers.get('last-event-id', '').rpartition('-')
+    if last_id.isdigit():
+        since_id = int(last_id)
+        if generation_id.isdigit():
+            generation = int(generation_id)
+
+    async def events():
+        cursor, known = since_id, generation
+        wakeup = notifier.subscribe(session_id)
+        try:
+            while True:
+                # Limpa antes de ler: um commit durante a leitura acorda o próximo wait.
+                wakeup.clear()
+                current, rows = await run_db(fetch_rows, session_id, cursor)
+                if known is not None and current != known and cursor:
+                    cursor, known = 0, current    # sessão recriada: recomeça do início
+                    continue
+                known = current
+                if rows:
+                    cursor = rows[-1]['id']
+                    yield sse_event('rows', {'generation': current, 'rows': rows},
+                                    event_id=f'{current}-{cursor}')
+                    if len(rows) >= SESSION_PAGE_MAX:
+                        continue   # histórico longo: manda a próxima página sem esperar
+                try:
+                    await asyncio.wait_for(wakeup.wait(), STREAM_KEEPALIVE_S)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                if await request.is_disconnected():
+                    break
+        finally:
+            notifier.unsubscribe(session_id, wakeup)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
+
+# ─── Remoção e arquivamento de sessões ──────────────────
+def drop_session(session_id):
+    """Apaga a sessão inteira: linhas (em blocos, ou o arquivo da sessão no
+    modo 'session'), Parquet, catálogo e presença."""
     db = get_db()
-    rows = db.execute(
-        'SELECT * FROM telemetry WHERE session_id=? AND id>? ORDER BY id',
-        (session_id, since_id)
-    ).fetchall()
-    return [dict(r) for r in rows]
+    if partitions is None:
+        delete_rows(db, session_id)
+    else:
+        partitions.drop(session_id)
+    archive_path(session_id).unlink(missing_ok=True)
+    with db:
+        db.execute('DELETE FROM sessions WHERE session_id=?', (session_id,))
+        db.execute('DELETE FROM session_drivers WHERE session_id=?', (session_id,))
+        db.execute('DELETE FROM presence WHERE session_id=?', (session_id,))
+    hot_cache.invalidate(session_id)
+    presence.drop(session_id)
+    lap_windows.forget(session_id)
+    publish('dropped', session_id)
+
+def archive_session(session_id):
+    """Exporta a sessão para Parquet e remove do SQLite o que foi exportado."""
+    db = get_db()
+    with session_db(session_id) as sdb:
+        max_id = export_session(sdb, session_id)
+        if not max_id:
+            return 0
+        # Primeiro aponta as leituras para o Parquet, depois apaga do SQLite.
+        with db:
+            db.execute('UPDATE sessions SET archived_max_id=? WHERE session_id=?', (max_id, session_id))
+        deleted = delete_rows(sdb, session_id, max_id)
+        if sdb is not db:
+            reclaim_space(sdb)
+    return deleted
+
+archiver = Archiver(archive_session, drop_session, get_db)
+
+# Operações de sessão que, no modo 'remote', rodam no processo escritor.
+SESSION_JOBS = {'drop_session': drop_session, 'archive_session': archive_session}
+
+async def run_session_job(name, session_id):
+    if WRITER_MODE == 'remote':
+        try:
+            return await asyncio.wrap_future(writer.call(name, session_id))
+        except ConnectionError:
+            raise HTTPException(status_code=503, detail='Telemetry writer unavailable')
+    return await run_db(SESSION_JOBS[name], session_id, bulk=True)
+
+@app.on_event('startup')
+def start_archiver():
+    if WRITER_MODE != 'remote':   # no modo 'remote' o arquivamento roda no escritor
+        archiver.start()
 
 # ─── Reseta (apaga) todos os dados de uma sessão ────────
+def catalog_entry(session_id):
+    return get_db().execute('SELECT * FROM sessions WHERE session_id=?', (session_id,)).fetchone()
+
 @app.delete('/session/{session_id}')
-def reset_session(session_id: str):
-    db = get_db()
-    result = db.execute(
-        'SELECT COUNT(*) as total FROM telemetry WHERE session_id=?',
-        (session_id,)
-    ).fetchone()
-    if result['total'] == 0:
+async def reset_session(session_id: str):
+    found = await run_db(catalog_entry, session_id)
+    if found is None:
         raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
-    db.execute('DELETE FROM telemetry WHERE session_id=?', (session_id,))
-    db.commit()
-    return {'status': 'ok', 'session_id': session_id, 'rows_deleted': result['total']}
+    await run_session_job('drop_session', session_id)
+    return {'status': 'ok', 'session_id': session_id, 'rows_deleted': found['row_count']}
+
+# ─── Arquiva uma sessão manualmente (Parquet) ───────────
+@app.post('/session/{session_id}/archive')
+async def archive_session_now(session_id: str):
+    if not archive_available():
+        raise HTTPException(status_code=503, detail='Archiving requires pyarrow')
+    if await run_db(catalog_entry, session_id) is None:
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found")
+    rows_archived = await run_session_job('archive_session', session_id)
+    return {'status': 'ok', 'session_id': session_id, 'rows_archived': rows_archived}
 
 # ─── Lista todas as sessões disponíveis ─────────────────
+# ?details=true devolve o catálogo completo (primeiro/último registro, linhas, pilotos).
 @app.get('/sessions')
-def list_sessions():
+async def list_sessions(details: bool = False):
+    return await run_db(catalog, details)
+
+def catalog(details=False):
     db = get_db()
     rows = db.execute(
-        'SELECT DISTINCT session_id FROM telemetry ORDER BY session_id'
+        'SELECT session_id, first_seen, last_seen, row_count, archived_max_id FROM sessions '
+        'ORDER BY session_id'
     ).fetchall()
-    return [r['session_id'] for r in rows]
+    if not details:
+        return [r['session_id'] for r in rows]
+    drivers = {}
+    for r in db.execute('SELECT session_id, driver FROM session_drivers ORDER BY driver'):
+        drivers.setdefault(r['session_id'], []).append(r['driver'])
+    return [{**dict(r), 'drivers': drivers.get(r['session_id'], [])} for r in rows]
+
+# ─── Métricas (Prometheus) ──────────────────────────────
+commit_seconds = Histogram(
+    'telemetry_commit_seconds', 'Duração de cada transação de escrita no SQLite (group commit)',
+)
+ingest_latency = Histogram(
+    'telemetry_ingest_latency_seconds', 'Do relógio do piloto (client_ms) ao commit no servidor',
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+rows_committed = Counter(
+    'telemetry_rows_committed_total', 'Registros processados pelo escritor (lap, duplicate, presence)', ('kind',),
+)
+Gauge('telemetry_writer_queue_depth', 'Jobs aguardando o escritor', lambda: writer.depth)
+Gauge('telemetry_stream_subscribers', 'Conexões SSE abertas', lambda: notifier.subscriber_count)
+Gauge(
+    'telemetry_cache_events_total', 'Eventos do cache quente', lambda: [
+        ({'event': k}, hot_cache.stats()[k]) for k in ('hits', 'misses', 'refreshes', 'evictions')
+    ], ('event',), kind='counter',
+)
+Gauge(
+    'telemetry_cache_entries', 'Sessões e linhas no cache quente', lambda: [
+        ({'unit': k}, hot_cache.stats()[k]) for k in ('sessions', 'rows')
+    ], ('unit',),
+)
+Gauge('telemetry_cache_hit_rate', 'Taxa de acerto do cache quente', lambda: hot_cache.stats()['hit_rate'])
+Gauge(
+    'telemetry_session_rows', 'Voltas por sessão (catálogo)', lambda: [
+        ({'session_id': r['session_id']}, r['row_count'])
+        for r in get_db().execute('SELECT session_id, row_count FROM sessions')
+    ], ('session_id',),
+)
+Gauge(
+    'telemetry_partition_connections', 'Conexões ociosas no pool de arquivos por sessão',
+    lambda: partitions.open_count if partitions is not None else 0,
+)
+
+@app.get('/metrics')
+async def metrics():
+    return Response(await run_db(render_all), media_type='text/plain; version=0.0.4; charset=utf-8')
 
 # ─── Health check ────────────────────────────────────────
 @app.get('/')
-def root():
-    return {'status': 'iRacing Telemetry Server Online'}
\ No newline at end of file
+async def root():
+    return {'status': 'iRacing Telemetry Server Online', 'cache': hot_cache.stats()}
\ No newline at end of file
@@ -0,0 +1,142 @@
+import json
+import os
+from collections import deque
+from pathlib import Path
+from config import SPOOL_DIR, SPOOL_MAX_BYTES, SPOOL_COMPACT_BYTES
+
+# ==============================
+# Spool em disco das voltas a enviar (store-and-forward)
+# ==============================
+# Toda volta entra primeiro num journal append-only (uma linha JSON por volta,
+# com número de sequência) e só sai dele quando o servidor confirma. Se a nuvem
+# ou o túnel cair no meio do stint — ou o script for fechado — as voltas ficam
+# no disco e são reenviadas em ordem, em lotes, quando a conexão volta.
+#
+#   journal.jsonl    {"seq": 12, "label": "Volta 7", "lap": {...payload...}}
+#   checkpoint.json  {"acked": 11}  → última sequência confirmada
+#
+# O append só faz flush (sobrevive ao fechamento do processo); o fsync é feito
+# uma vez por lote, antes do envio (sync()). O checkpoint não precisa de fsync:
+# perdê-lo só reenvia voltas que o servidor descarta como duplicadas.
+# Quando o trecho já confirmado passa de SPOOL_COMPACT_BYTES o journal é
+# reescrito só com as pendentes. Acima de SPOOL_MAX_BYTES as voltas mais
+# antigas são descartadas (continuam no CSV local).
+#
+# Não é thread-safe: o Uplink chama tudo sob o próprio lock.
+
+
+class LapSpool:
+    def __init__(self, directory=SPOOL_DIR, max_bytes=SPOOL_MAX_BYTES, compact_bytes=SPOOL_COMPACT_BYTES):
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._journal_path = self._dir / 'journal.jsonl'
+        self._checkpoint_path = self._dir / 'checkpoint.json'
+        self._max_bytes = max_bytes
+        self._compact_bytes = compact_bytes
+        self._entries = deque()       # (seq, payload, label, bytes) ainda não confirmadas
+        self._pending_bytes = 0
+        self._acked_bytes = 0         # bytes do journal que já foram confirmados
+        self._seq = 0
+        self._load()
+        self._file = open(self._journal_path, 'a', encoding='utf-8')
+        self._dirty = False
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def append(self, payload, label=''):
+        """Grava a volta no journal (flush, sem fsync) e devolve a sequência."""
+        self._seq += 1
+        line = json.dumps({'seq': self._seq, 'label': label, 'lap': payload}, ensure_ascii=False) + '\n'
+        self._file.write(line)
+        self._file.flush()
+        self._dirty = True
+        size = len(line.encode('utf-8'))
+        self._entries.append((self._seq, payload, label, size))
+        self._pending_bytes += size
+        if self._pending_bytes + self._acked_bytes > self._max_bytes:
+            self._enforce_cap()
+        return self._seq
+
+    def sync(self):
+        """fsync das voltas gravadas desde a última chamada (uma vez por lote)."""
+        if self._dirty:
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def peek(self, n):
+        """Até `n` voltas pendentes mais antigas: [(seq, payload, label)]."""
+        return [entry[:3] for entry in list(self._entries)[:n]]
+
+    def ack(self, seq):
+        """Confirma todas as voltas até `seq` (inclusive)."""
+        while self._entries and self._entries[0][0] <= seq:
+            size = self._entries.popleft()[3]
+            self._pending_bytes -= size
+            self._acked_bytes += size
+        tmp = self._checkpoint_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'acked': seq}), encoding='utf-8')
+        os.replace(tmp, self._checkpoint_path)
+        if not self._entries:
+            self._file.truncate(0)    # tudo confirmado: o journal volta a ficar vazio
+            self._acked_bytes = 0
+        elif self._acked_bytes >= self._compact_bytes:
+            self._rewrite()
+
+    def close(self):
+        self.sync()
+        self._file.close()
+
+    # ─── Internos ───────────────────────────────────────
+    def _load(self):
+        acked = 0
+        if self._checkpoint_path.exists():
+            try:
+                acked = json.loads(self._checkpoint_path.read_text(encoding='utf-8'))['acked']
+            except (ValueError, KeyError):
+                pass
+        self._seq = acked
+        if not self._journal_path.exists():
+            return
+        with open(self._journal_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue    # última linha cortada por um desligamento no meio da escrita
+                size = len(line.encode('utf-8'))
+                self._seq = max(self._seq, record['seq'])
+                if record['seq'] <= acked:
+                    self._acked_bytes += size
+                    continue
+                self._entries.append((record['seq'], record['lap'], record['label'], size))
+                self._pending_bytes += size
+        if self._entries:
+            print(f"📦 Spool: {len(self._entries)} volta(s) pendentes de envio recuperadas do disco")
+
+    def _rewrite(self):
+        """Reescreve o journal só com as voltas pendentes (troca atômica)."""
+        self._file.close()
+        tmp = self._journal_path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for seq, payload, label, _ in self._entries:
+                f.write(json.dumps({'seq': seq, 'label': label, 'lap': payload}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._journal_path)
+        self._acked_bytes = 0
+        self._file = open(self._journal_path, 'a', encoding='utf-8')
+        self._dirty = False
+
+    def _enforce_cap(self):
+        lost = []
+        while self._entries and self._pending_bytes > self._max_bytes * 0.9:
+            _, _, label, size = self._entries.popleft()
+            self._pending_bytes -= size
+            lost.append(label)
+        if lost:
+            self.dropped += len(lost)
+            print(f"⚠️ Spool cheio ({self._max_bytes // 1_000_000} MB): {len(lost)} volta(s) "
+                  f"mais antigas descartadas da nuvem ({lost[0]}…), continuam no CSV")
+        self._rewrite()
@@ -0,0 +1,58 @@
+import asyncio
+import json
+import threading
+
+# ==============================
+# Notificação de novas linhas por sessão (SSE)
+# ==============================
+# A thread escritora chama notify() após cada commit; cada conexão de stream
+# aguarda num asyncio.Event em vez de consultar o banco periodicamente.
+
+
+class SessionNotifier:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}    # session_id -> {asyncio.Event: loop}
+
+    def subscribe(self, session_id):
+        event = asyncio.Event()
+        with self._lock:
+            self._subscribers.setdefault(session_id, {})[event] = asyncio.get_running_loop()
+        return event
+
+    def unsubscribe(self, session_id, event):
+        with self._lock:
+            subs = self._subscribers.get(session_id)
+            if subs is not None:
+                subs.pop(event, None)
+                if not subs:
+                    del self._subscribers[session_id]
+
+    def notify(self, session_ids):
+        """Acorda os streams das sessões informadas (thread-safe)."""
+        with self._lock:
+            targets = [
+                (event, loop)
+                for session_id in session_ids
+                for event, loop in self._subscribers.get(session_id, {}).items()
+            ]
+        for event, loop in targets:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass   # loop já encerrado
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+
+def sse_event(event, data, event_id=None):
+    """Formata uma mensagem Server-Sent Events."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
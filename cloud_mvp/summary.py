@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+
+# ==============================
+# Resumo da sessão calculado no SQLite
+# ==============================
+# Mesmas regras do render_metrics do dashboard (stints, melhor volta, médias de
+# 3 voltas, consumo e autonomia), mas com funções de janela do SQLite sobre as
+# voltas válidas (lap_time > 0), usando os índices por sessão/piloto.
+#
+# Sessões arquivadas: as linhas que estão no Parquet (archive.read_rows) entram
+# numa tabela temporária em memória e as consultas leem a união dela com as
+# linhas vivas, então o resumo continua cobrindo a sessão inteira.
+
+REFUEL_JUMP_L = 1.0     # combustível subindo mais que isso entre voltas = novo stint
+MAX_LAP_CONSUMPTION_L = 20
+ACTIVE_PRESENCE_S = 15  # heartbeat mais velho que isso não conta como piloto no carro (igual ao dashboard)
+
+# Colunas usadas pelo resumo (as únicas carregadas do arquivo).
+SUMMARY_COLUMNS = ('id', 'session_id', 'driver', 'lap', 'lap_time', 'fuel', 'position',
+                   'class_position', 'session_type', 'timestamp', 'state')
+
+STINTS_SQL = '''
+    WITH laps AS (
+        SELECT id, driver, lap, lap_time, fuel, timestamp,
+               CASE WHEN LAG(driver) OVER w IS NULL
+                         OR driver <> LAG(driver) OVER w
+                         OR fuel > LAG(fuel) OVER w + :refuel_jump
+                    THEN 1 ELSE 0 END AS stint_change
+        FROM {source}
+        WHERE session_id = :session_id AND session_type = :session_type AND lap_time > 0
+        WINDOW w AS (ORDER BY lap, timestamp, id)
+    ), numbered AS (
+        SELECT *, SUM(stint_change) OVER (ORDER BY lap, timestamp, id
+                                          ROWS UNBOUNDED PRECEDING) AS stint
+        FROM laps
+    )
+    SELECT stint, driver, MIN(lap) AS first_lap, MAX(lap) AS last_lap,
+           COUNT(*) AS laps, MIN(lap_time) AS best_lap, AVG(lap_time) AS avg_lap
+    FROM numbered
+    GROUP BY stint
+    ORDER BY stint
+'''
+
+DRIVERS_SQL = '''
+    WITH laps AS (
+        SELECT driver, lap, lap_time, fuel,
+               LAG(fuel) OVER (PARTITION BY driver ORDER BY lap, id) AS prev_fuel,
+               ROW_NUMBER() OVER (PARTITION BY driver ORDER BY lap DESC, id DESC) AS rn
+        FROM {source}
+        WHERE session_id = :session_id AND session_type = :session_type AND lap_time > 0
+              AND (:driver IS NULL OR driver = :driver)
+    ), consumption AS (
+        SELECT *, CASE WHEN prev_fuel - fuel > 0 AND prev_fuel - fuel < :max_consumption
+                       THEN prev_fuel - fuel ELSE 0 END AS used
+        FROM laps
+    )
+    SELECT driver,
+           COUNT(*)                                    AS laps,
+           MIN(lap_time)                               AS best_lap,
+           MAX(CASE WHEN rn = 1 THEN lap END)          AS last_lap_number,
+           MAX(CASE WHEN rn = 1 THEN lap_time END)     AS last_lap,
+           MAX(CASE WHEN rn = 1 THEN used END)         AS last_consumption,
+           CASE WHEN COUNT(*) >= 3 THEN AVG(CASE WHEN rn <= 3 THEN lap_time END)
+                ELSE MAX(CASE WHEN rn = 1 THEN lap_time END) END AS avg_lap_3,
+           CASE WHEN COUNT(*) >= 3 THEN AVG(CASE WHEN rn <= 3 THEN used END)
+                ELSE MAX(CASE WHEN rn = 1 THEN used END) END     AS avg_consumption_3
+    FROM consumption
+    GROUP BY driver
+'''
+
+# Última volta de cada piloto: combustível, posição e estado no fim da volta.
+# Heartbeats ficam na tabela presence; o estado atual vem de `presence`.
+LATEST_SQL = '''
+    SELECT t.driver, t.fuel, t.position, t.class_position, t.state
+    FROM {source} t
+    JOIN (SELECT driver, MAX(id) AS id FROM {source}
+          WHERE session_id = :session_id AND session_type = :session_type
+                AND (:driver IS NULL OR driver = :driver)
+          GROUP BY driver) m ON t.id = m.id
+    ORDER BY t.id
+'''
+
+
+def session_types(db, session_id, source='telemetry'):
+    return [r[0] for r in db.execute(
+        f'SELECT DISTINCT session_type FROM {source} WHERE session_id=:session_id',
+        {'session_id': session_id}
+    )]
+
+
+@contextmanager
+def laps_source(db, archived):
+    """Origem das voltas para as consultas: `telemetry`, ou a união dela com as
+    linhas arquivadas (carregadas numa tabela temporária, apagada no fim)."""
+    if not archived:
+        yield 'telemetry'
+        return
+    columns = ', '.join(SUMMARY_COLUMNS)
+    with db:
+        db.execute(f'CREATE TEMP TABLE IF NOT EXISTS archived_laps ({columns})')
+        db.execute('DELETE FROM temp.archived_laps')
+        db.executemany(
+            f"INSERT INTO temp.archived_laps VALUES ({', '.join('?' * len(SUMMARY_COLUMNS))})",
+            [tuple(r[name] for name in SUMMARY_COLUMNS) for r in archived]
+        )
+    try:
+        yield (f'(SELECT {columns} FROM telemetry WHERE session_id = :session_id '
+               f'UNION ALL SELECT {columns} FROM temp.archived_laps)')
+    finally:
+        with db:
+            db.execute('DELETE FROM temp.archived_laps')
+
+
+def compute_summary(db, session_id, session_type=None, driver=None, presence=(), archived=()):
+    """Resumo da sessão (ou de um piloto) para o tipo de sessão informado.
+
+    Sem `session_type`, usa 'Race' se existir, senão o primeiro tipo encontrado
+    (mesmo padrão do seletor do dashboard). `presence` (registro de heartbeats)
+    atualiza combustível, posição e estado entre voltas e define o piloto ativo.
+    Sessão só com presença (ninguém fechou volta ainda) tem resumo vazio.
+    `archived` são as linhas já movidas para o Parquet (colunas SUMMARY_COLUMNS).
+    Retorna None se a sessão não existe.
+    """
+    with laps_source(db, archived) as source:
+        return _compute_summary(db, session_id, session_type, driver, presence, source)
+
+
+def _compute_summary(db, session_id, session_type, driver, presence, source):
+    types = session_types(db, session_id, source)
+    if not types:
+        types = sorted({p['session_type'] for p in presence})
+        if not types:
+            return None
+    if session_type is None:
+        session_type = 'Race' if 'Race' in types else types[0]
+    params = {
+        'session_id': session_id, 'session_type': session_type, 'driver': driver,
+        'refuel_jump': REFUEL_JUMP_L, 'max_consumption': MAX_LAP_CONSUMPTION_L,
+    }
+
+    stints = [dict(r) for r in db.execute(STINTS_SQL.format(source=source), params)]
+    latest = {r['driver']: dict(r) for r in db.execute(LATEST_SQL.format(source=source), params)}
+    for p in presence:
+        if p['session_type'] == session_type and driver in (None, p['driver']):
+            latest.setdefault(p['driver'], {}).update(
+                fuel=p['fuel'], position=p['position'],
+                class_position=p['class_position'], state=p['state'],
+            )
+
+    drivers = {}
+    for r in db.execute(DRIVERS_SQL.format(source=source), params):
+        drivers[r['driver']] = dict(r)
+    for name, last in latest.items():
+        d = drivers.setdefault(name, {'driver': name, 'laps': 0})
+        d.update(fuel=last['fuel'], position=last['position'],
+                 class_position=last['class_position'], state=last['state'])
+        # Autonomia: consumo da última volta, com fallback para a média de 3 voltas.
+        cons = d.get('last_consumption') or d.get('avg_consumption_3') or 0
+        d['autonomy_laps'] = round(last['fuel'] / cons, 1) if cons > 0 and last['fuel'] else 0
+        # Voltas no último stint contínuo deste piloto.
+        own = [s for s in stints if s['driver'] == name]
+        d['stint_laps'] = own[-1]['laps'] if own else 0
+
+    total_laps = max((s['last_lap'] for s in stints), default=0)
+    if driver is not None:
+        stints = [s for s in stints if s['driver'] == driver]
+
+    team_last = list(latest.values())[-1] if latest else {}
+    # Piloto ativo: heartbeat recente com estado 'cockpit' (o mais novo, se houver dois).
+    in_car = [p for p in presence if p['state'] == 'cockpit' and p['age_s'] <= ACTIVE_PRESENCE_S]
+    active = max(in_car, key=lambda p: p['last_seen'])['driver'] if in_car else None
+    return {
+        'session_id':     session_id,
+        'session_type':   session_type,
+        'session_types':  types,
+        'active_driver':  active,
+        'total_laps':     total_laps,
+        'position':       team_last.get('position', 0),
+        'class_position': team_last.get('class_position', 0),
+        'drivers':        drivers,
+        'stints':         stints,
+    }
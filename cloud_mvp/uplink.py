@@ -0,0 +1,259 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from config import (
+    UPLINK_TIMEOUT_S, UPLINK_CONNECT_TIMEOUT_S, UPLINK_STOP_TIMEOUT_S, UPLINK_BATCH_LAPS,
+    UPLINK_BACKOFF_BASE_S, UPLINK_BACKOFF_MAX_S, UPLINK_BREAKER_FAILURES,
+)
+
+# ==============================
+# Envio em segundo plano (read_iracing_cloud.py)
+# ==============================
+# O loop de leitura do SDK não espera mais a rede: voltas e heartbeats são
+# entregues a uma thread que faz os POSTs.
+#   - Voltas: gravadas no spool em disco (spool.py) e enviadas em ordem, em
+#     lotes de até UPLINK_BATCH_LAPS via /telemetry/batch, até o servidor
+#     confirmar (o índice único do servidor descarta uma volta que chegue duas
+#     vezes). Voltas não enviadas sobrevivem a quedas da rede e do script.
+#   - Heartbeats: só o mais recente importa; um novo substitui o que ainda não
+#     saiu e um heartbeat que falha não é reenviado.
+# Voltas têm prioridade sobre heartbeats.
+#
+# Os POSTs usam uma requests.Session (keep-alive): a conexão TCP+TLS com o
+# servidor é reaproveitada em vez de ser aberta a cada volta/heartbeat.
+# Falhas seguidas espaçam as tentativas (backoff exponencial com limite) e, a
+# partir de UPLINK_BREAKER_FAILURES, o disjuntor abre: heartbeats são
+# descartados e só as voltas continuam esperando a próxima tentativa.
+
+
+class CircuitBreaker:
+    """Backoff exponencial limitado (com jitter) + estado aberto/fechado."""
+
+    def __init__(self, threshold=UPLINK_BREAKER_FAILURES,
+                 base_s=UPLINK_BACKOFF_BASE_S, max_s=UPLINK_BACKOFF_MAX_S):
+        self._threshold = threshold
+        self._base_s = base_s
+        self._max_s = max_s
+        self.failures = 0           # falhas consecutivas
+        self.retry_at = 0.0         # monotonic; antes disso não tenta de novo
+
+    @property
+    def is_open(self):
+        return self.failures >= self._threshold
+
+    def success(self):
+        """Registra um envio bem-sucedido; True se o disjuntor estava aberto."""
+        was_open = self.is_open
+        self.failures = 0
+        self.retry_at = 0.0
+        return was_open
+
+    def failure(self):
+        """Registra uma falha e devolve a espera (s) até a próxima tentativa."""
+        self.failures += 1
+        delay = min(self._max_s, self._base_s * 2 ** (self.failures - 1))
+        delay *= random.uniform(0.8, 1.2)   # pilotos não voltam todos no mesmo instante
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+
+class Uplink:
+    def __init__(self, base_url, headers, spool):
+        self._base_url = base_url
+        self._session = requests.Session()
+        self._session.headers.update(headers)
+        # Uma thread de envio → uma conexão por host basta; sem retries do urllib3
+        # (o reenvio é decidido aqui, com backoff).
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        self._session.mount('http://', self._adapter)
+        self._session.mount('https://', self._adapter)
+        self._breaker = CircuitBreaker()
+        self._cond = threading.Condition()
+        self._spool = spool                # voltas pendentes (LapSpool), sob self._cond
+        self._presence = None              # heartbeat mais recente ainda não enviado
+        self._stopping = False
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    @property
+    def pending(self):
+        with self._cond:
+            return len(self._spool)
+
+    @property
+    def online(self):
+        """False enquanto o disjuntor está aberto (servidor inacessível)."""
+        return not self._breaker.is_open
+
+    def connection_stats(self):
+        """(conexões abertas, requisições feitas) desde o início; com keep-alive
+        a primeira conta fica perto de 1 enquanto a segunda cresce."""
+        pools = self._adapter.poolmanager.pools
+        stats = [(pools[key].num_connections, pools[key].num_requests) for key in pools.keys()]
+        return sum(s[0] for s in stats), sum(s[1] for s in stats)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='cloud-uplink', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=UPLINK_STOP_TIMEOUT_S):
+        """Tenta entregar as voltas pendentes (até `timeout` s) e encerra a thread."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._stopping = True
+            self._breaker.retry_at = 0.0
+            self._cond.notify()
+        self._thread.join(timeout)
+        finished = not self._thread.is_alive()
+        self._thread = None
+        self._session.close()
+        with self._cond:
+            if finished:    # senão a thread ainda está num POST; o journal já tem flush
+                self._spool.close()
+            if len(self._spool):
+                print(f"📦 {len(self._spool)} volta(s) ficam no spool e serão enviadas na próxima execução")
+
+    def send_lap(self, payload, label=''):
+        """Grava a volta no spool e acorda a thread de envio (não espera a rede)."""
+        with self._cond:
+            self._spool.append(payload, label)
+            self._cond.notify()
+
+    def send_presence(self, payload):
+        """Agenda o heartbeat, substituindo o anterior se ainda não saiu (não bloqueia).
+        Com o disjuntor aberto o heartbeat é descartado."""
+        with self._cond:
+            if self._breaker.is_open:
+                return
+            self._presence = payload
+            self._cond.notify()
+
+    # ─── Thread de envio ────────────────────────────────
+    def _next(self):
+        """Próximo envio: ('laps', lote) | ('presence', payload) | None para encerrar."""
+        with self._cond:
+            while True:
+                wait = self._breaker.retry_at - time.monotonic()
+                if wait <= 0:
+                    if len(self._spool):
+                        self._spool.sync()   # o lote está no disco antes de sair
+                        return 'laps', self._spool.peek(UPLINK_BATCH_LAPS)
+                    if self._presence is not None:
+                        payload, self._presence = self._presence, None
+                        return 'presence', payload
+                if self._stopping and not len(self._spool):
+                    return None
+                self._cond.wait(wait if wait > 0 else None)
+
+    def _run(self):
+        while True:
+            try:
+                job = self._next()
+                if job is None or not self._send(*job):
+                    return
+            except Exception as e:
+                # Erro inesperado (ex: OSError no spool) não pode matar a thread:
+                # as voltas continuam no spool e a tentativa é espaçada pelo backoff.
+                with self._cond:
+                    delay = self._breaker.failure()
+                    if self._breaker.is_open:
+                        self._presence = None
+                print(f"⚠️ Uplink: {type(e).__name__}: {e} — nova tentativa em {delay:.1f}s")
+                if self._stopping:
+                    return
+
+    def _send(self, kind, item):
+        """Faz um envio e atualiza spool/disjuntor; False para encerrar a thread."""
+        start = time.perf_counter()
+        if kind == 'presence':
+            _, error, retry = self._post('/presence', item)
+            rejected, label = [], 'Heartbeat'
+        else:
+            error, retry, rejected = self._post_laps(item)
+            label = item[0][2] if len(item) == 1 else f"{item[0][2]} … {item[-1][2]} ({len(item)} voltas)"
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._cond:
+            if retry:
+                delay = self._breaker.failure()
+                if self._breaker.is_open:
+                    self._presence = None
+            elif self._breaker.success():
+                print("🔌 Conexão com a nuvem restabelecida")
+            if kind == 'laps':
+                if not retry:
+                    # Aceito (ou recusado de vez pelo servidor): sai do spool.
+                    self._spool.ack(item[-1][0])
+                    lost = len(rejected) if error is None else len(item)
+                    self.sent += len(item) - lost
+                    self.dropped += lost
+                else:
+                    self.failed += 1
+            pending = len(self._spool)
+        if error is None:
+            if kind == 'laps':
+                connections, requests_made = self.connection_stats()
+                print(f"   ☁️ {label} | ✅ Cloud OK {elapsed_ms:.0f} ms (fila: {pending}) "
+                      f"| conexões: {connections} p/ {requests_made} req")
+            for lap_label, detail in rejected:
+                print(f"   ☁️ {lap_label} | ❌ Cloud recusou: {detail}")
+        elif not retry:
+            print(f"   ☁️ {label} | ❌ Cloud recusou: {error}")
+        else:
+            print(f"   ☁️ {label} | ❌ Cloud Fail: {error} — nova tentativa em "
+                  f"{delay:.1f}s (fila: {pending})")
+            if self._breaker.failures == UPLINK_BREAKER_FAILURES:
+                print(f"🔌 Servidor inacessível após {UPLINK_BREAKER_FAILURES} falhas: "
+                      f"heartbeats suspensos, voltas aguardando no spool")
+            if self._stopping:
+                return False    # no encerramento não insiste: o spool guarda o resto
+        return True
+
+    def _post_laps(self, batch):
+        """POST /telemetry/batch; devolve (erro, vale_reenviar, [(rótulo, motivo)] recusadas)."""
+        response, error, retry = self._post('/telemetry/batch', [payload for _, payload, _ in batch])
+        if error is not None:
+            return error, retry, []
+        # Um 2xx que não é a resposta do servidor (página HTML de túnel/proxy)
+        # não confirma nada: o lote fica no spool.
+        try:
+            results = response.json()['results']
+            rejected = [
+                (batch[r['index']][2], r.get('detail', ''))
+                for r in results if r.get('status') == 'error'
+            ]
+        except (ValueError, KeyError, TypeError, IndexError, AttributeError):
+            return f'resposta inesperada (HTTP {response.status_code})', True, []
+        return None, False, rejected
+
+    def _post(self, path, payload):
+        """Retorna (resposta, erro, vale_reenviar); erro None quando o servidor aceitou."""
+        try:
+            response = self._session.post(self._base_url + path, json=payload,
+                                          timeout=(UPLINK_CONNECT_TIMEOUT_S, UPLINK_TIMEOUT_S))
+        except requests.RequestException as e:
+            return None, str(e), True
+        if response.status_code >= 400:
+            return response, f'HTTP {response.status_code}', not self._rejected_by_server(response)
+        return response, None, False
+
+    @staticmethod
+    def _rejected_by_server(response):
+        """Recusa definitiva: só 413/422 com o `detail` JSON do FastAPI (o lote se
+        repetiria sempre). Qualquer outro erro — 404 do ngrok com o túnel fora do
+        ar, 401/403 de proxy, 5xx, servidor sem /telemetry/batch — pode ser
+        passageiro e o lote continua no spool, com backoff."""
+        if response.status_code not in (413, 422):
+            return False
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and 'detail' in body
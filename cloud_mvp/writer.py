@@ -0,0 +1,99 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from config import WRITER_MAX_BATCH_ROWS, WRITER_MAX_DELAY_MS
+
+# ==============================
+# Group commit de ingest
+# ==============================
+# As requisições de /telemetry não gravam mais no SQLite: enfileiram os registros
+# validados e esperam o Future. Uma única thread escritora drena a fila, junta
+# tudo o que chegou em até WRITER_MAX_DELAY_MS (ou WRITER_MAX_BATCH_ROWS linhas)
+# e grava numa transação só, respondendo às requisições depois do commit.
+# Com um único escritor não há disputa pelo lock de escrita do SQLite.
+# Se commit_fn devolver uma lista (um resultado por registro), cada Future
+# recebe a fatia correspondente aos seus registros.
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    def __init__(self, commit_fn, max_rows=WRITER_MAX_BATCH_ROWS, max_delay_ms=WRITER_MAX_DELAY_MS):
+        self._commit_fn = commit_fn          # recebe a lista de registros do grupo inteiro
+        self._max_rows = max_rows
+        self._max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+
+    @property
+    def depth(self):
+        """Jobs aguardando na fila (aproximado)."""
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='telemetry-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Grava o que ainda está na fila e encerra a thread escritora."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, records):
+        """Enfileira registros; o Future resolve quando estiverem commitados."""
+        future = Future()
+        if self._thread is None:
+            future.set_exception(RuntimeError('Telemetry writer is not running'))
+            return future
+        self._queue.put((records, future))
+        return future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is _STOP:
+                break
+            # Requisição que já desistiu (timeout/cancelamento) não é gravada.
+            if not job[1].set_running_or_notify_cancel():
+                continue
+            jobs, rows = [job], len(job[0])
+            deadline = time.monotonic() + self._max_delay
+            while rows < self._max_rows:
+                try:
+                    nxt = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stopping = True
+                    break
+                if not nxt[1].set_running_or_notify_cancel():
+                    continue
+                jobs.append(nxt)
+                rows += len(nxt[0])
+            self._commit(jobs)
+
+    def _commit(self, jobs):
+        try:
+            results = self._commit_fn([r for records, _ in jobs for r in records])
+        except Exception as e:
+            if len(jobs) == 1:
+                jobs[0][1].set_exception(e)
+                return
+            # Um job com problema não pode derrubar o grupo: regrava um a um.
+            for job in jobs:
+                self._commit([job])
+            return
+        offset = 0
+        for records, future in jobs:
+            if results is None:
+                future.set_result(None)
+            else:
+                future.set_result(results[offset:offset + len(records)])
+            offset += len(records)
@@ -0,0 +1,283 @@
+import itertools
+import os
+import queue
+import secrets
+import signal
+import socket
+import stat
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from config import (
+    WRITER_ADDRESS, WRITER_AUTHKEY, WRITER_AUTHKEY_FILE, WRITER_RECONNECT_S, DB_BULK_WORKERS,
+)
+
+# ==============================
+# Processo escritor único (modo multi-worker)
+# ==============================
+# Com TELEMETRY_WRITER_MODE=remote, vários workers do uvicorn atendem as
+# leituras e nenhum deles grava no SQLite: as gravações vão, por um socket
+# local (multiprocessing.connection), para um único processo escritor que roda
+# o GroupCommitWriter. O group commit continua juntando registros de todos os
+# workers, e não há disputa de lock de escrita entre processos.
+#
+#   python writer_service.py &
+#   TELEMETRY_WRITER_MODE=remote uvicorn server:app --workers 4
+#
+# Depois de cada commit o escritor publica eventos para todos os workers
+# ('committed': sessões com voltas novas e presença; 'dropped': sessão apagada),
+# que atualizam o cache quente, o SSE e o registro de presença locais.
+#
+# Por padrão o canal é um socket unix (WRITER_ADDRESS="writer.sock"); com
+# host:porta vira TCP. A conexão só é aceita com a chave de load_authkey().
+#
+# Mensagens (pickle):
+#   worker → escritor: ('write', job_id, registros) | ('call', job_id, (nome, args))
+#   escritor → worker: ('result', job_id, valor) | ('error', job_id, texto)
+#                      | ('event', nome, *args)
+
+
+def parse_address(address):
+    """'host:porta' → (host, porta); qualquer outra coisa é caminho de socket unix."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return host or '127.0.0.1', int(port)
+    return address
+
+
+def load_authkey(create=False):
+    """Chave do handshake: TELEMETRY_WRITER_AUTHKEY ou o conteúdo de
+    WRITER_AUTHKEY_FILE. Com create=True (processo escritor) o arquivo é gerado
+    com uma chave aleatória, legível só pelo dono. Arquivo ausente levanta
+    FileNotFoundError; arquivo legível por outros usuários, PermissionError."""
+    if WRITER_AUTHKEY:
+        return WRITER_AUTHKEY
+    if create and not WRITER_AUTHKEY_FILE.exists():
+        try:
+            fd = os.open(WRITER_AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass    # outro processo criou no meio tempo
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            print(f"🔑 Chave do processo escritor gerada em {WRITER_AUTHKEY_FILE}")
+    if os.name != 'nt' and WRITER_AUTHKEY_FILE.stat().st_mode & 0o077:
+        raise PermissionError(f'{WRITER_AUTHKEY_FILE} is readable by other users (chmod 600)')
+    key = WRITER_AUTHKEY_FILE.read_text(encoding='utf-8').strip().encode()
+    if not key:
+        raise PermissionError(f'{WRITER_AUTHKEY_FILE} is empty')
+    return key
+
+
+def no_delay(conn, address):
+    """Desliga o algoritmo de Nagle em conexões TCP: as mensagens são pequenas e
+    há uma requisição HTTP esperando cada resposta (sem isso, ~40 ms por ida e volta)."""
+    if isinstance(address, tuple):
+        sock = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.close()    # fecha só a cópia do descritor
+
+
+class RemoteWriter:
+    """Cliente do processo escritor, com a mesma interface do GroupCommitWriter."""
+
+    def __init__(self, on_event, address=WRITER_ADDRESS, authkey=None):
+        self._on_event = on_event          # on_event(nome, *args), chamado na thread do cliente
+        self._address = parse_address(address)
+        self._authkey = authkey            # None: load_authkey() a cada conexão
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pending = {}                 # job_id -> Future
+        self._ids = itertools.count(1)
+        self._stopping = threading.Event()
+        self._thread = None
+
+    @property
+    def depth(self):
+        """Requisições aguardando resposta do processo escritor."""
+        return len(self._pending)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='writer-client', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(self, records):
+        """Envia registros; o Future resolve quando o escritor os tiver commitado."""
+        return self._request('write', records)
+
+    def call(self, name, *args):
+        """Executa uma operação de sessão (ex: drop_session) no processo escritor."""
+        return self._request('call', (name, args))
+
+    def _request(self, kind, payload):
+        future = Future()
+        future.set_running_or_notify_cancel()   # a resposta sempre pode ser entregue
+        with self._lock:
+            if self._conn is None:
+                future.set_exception(ConnectionError('Telemetry writer process is not connected'))
+                return future
+            job_id = next(self._ids)
+            self._pending[job_id] = future
+            try:
+                self._conn.send((kind, job_id, payload))
+            except (OSError, ValueError) as e:
+                self._pending.pop(job_id, None)
+                future.set_exception(ConnectionError(f'Telemetry writer process: {e}'))
+        return future
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                # A chave é lida a cada tentativa: o escritor pode ainda não tê-la gerado.
+                authkey = self._authkey or load_authkey()
+                conn = Client(self._address, authkey=authkey)
+                no_delay(conn, self._address)
+            except PermissionError as e:
+                print(f"⚠️ Chave do processo escritor recusada: {e}")
+                self._stopping.wait(WRITER_RECONNECT_S * 10)
+                continue
+            except (OSError, AuthenticationError):
+                self._stopping.wait(WRITER_RECONNECT_S)
+                continue
+            with self._lock:
+                self._conn = conn
+            print(f"🔌 Conectado ao processo escritor em {self._address}")
+            self._on_event('connected')
+            try:
+                while True:
+                    message = conn.recv()
+                    if message[0] == 'event':
+                        self._on_event(*message[1:])
+                        continue
+                    kind, job_id, value = message
+                    future = self._pending.pop(job_id, None)
+                    if future is None:
+                        continue
+                    if kind == 'result':
+                        future.set_result(value)
+                    else:
+                        future.set_exception(RuntimeError(value))
+            except (EOFError, OSError):
+                pass
+            finally:
+                with self._lock:
+                    self._conn = None
+                    pending, self._pending = self._pending, {}
+                conn.close()
+                for future in pending.values():
+                    future.set_exception(ConnectionError('Telemetry writer process disconnected'))
+            if not self._stopping.is_set():
+                print("⚠️ Conexão com o processo escritor perdida; tentando novamente...")
+                self._stopping.wait(WRITER_RECONNECT_S)
+
+
+# ==============================
+# Lado do processo escritor
+# ==============================
+class _Worker:
+    """Conexão de um worker: recebe pedidos e envia respostas/eventos por uma fila."""
+
+    def __init__(self, conn, server, executor, workers):
+        self._conn = conn
+        self._server = server
+        self._executor = executor
+        self._workers = workers
+        self._outbox = queue.Queue()
+
+    def send(self, message):
+        self._outbox.put(message)
+
+    def serve(self):
+        threading.Thread(target=self._send_loop, name='writer-send', daemon=True).start()
+        self._workers.add(self)
+        try:
+            while True:
+                kind, job_id, payload = self._conn.recv()
+                if kind == 'write':
+                    future = self._server.writer.submit(payload)
+                else:
+                    name, args = payload
+                    future = self._executor.submit(self._server.SESSION_JOBS[name], *args)
+                future.add_done_callback(lambda f, job_id=job_id: self._reply(job_id, f))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._workers.discard(self)
+            self._outbox.put(None)
+
+    def _reply(self, job_id, future):
+        error = future.exception()
+        if error is None:
+            self.send(('result', job_id, future.result()))
+        else:
+            self.send(('error', job_id, f'{type(error).__name__}: {error}'))
+
+    def _send_loop(self):
+        # Envio numa thread própria: um worker lento não segura o writer.
+        while (message := self._outbox.get()) is not None:
+            try:
+                self._conn.send(message)
+            except (OSError, ValueError):
+                break
+        self._conn.close()
+
+
+def serve(address=WRITER_ADDRESS, authkey=None):
+    # Sem chave o escritor não sobe: pickle de uma conexão não autenticada é execução de código.
+    authkey = authkey or load_authkey(create=True)
+    import config
+    config.WRITER_MODE = 'local'   # este processo é o escritor, mesmo com o env dos workers
+    import server                  # importado aqui: server.py importa RemoteWriter deste módulo
+
+    workers = set()
+
+    def publish(event, *args):
+        for worker in list(workers):
+            worker.send(('event', event, *args))
+
+    server.event_listeners.append(publish)
+    server.init_db()
+    server.start_writer()
+    server.start_archiver()
+    executor = ThreadPoolExecutor(DB_BULK_WORKERS, thread_name_prefix='writer-jobs')
+    address = parse_address(address)
+    if isinstance(address, str) and os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+        os.unlink(address)    # socket unix que sobrou de um escritor encerrado à força
+    listener = Listener(address, authkey=authkey)
+    print(f"🗄️ Processo escritor ouvindo em {listener.address}")
+    signal.signal(signal.SIGTERM, lambda *_: listener.close())
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                break    # listener fechado (SIGTERM)
+            except AuthenticationError:
+                continue
+            no_delay(conn, address)
+            worker = _Worker(conn, server, executor, workers)
+            threading.Thread(target=worker.serve, name='writer-worker', daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        executor.shutdown(wait=True)
+        server.close_db()
+
+
+if __name__ == '__main__':
+    serve()
@@ -9,3 +9,12 @@ LOG_DIR.mkdir(parents=True, exist_ok=True)
 REFRESH_RATE_ST = 2
 WINDOW_SIZE = 3
 
+# --- AMOSTRAGEM DO SDK (sampler.py) ---
+SAMPLE_HZ = 60                 # ticks por segundo (no máximo os 60 Hz do iRacing)
+SAMPLE_REPORT_S = 60           # intervalo do log de taxa medida / ticks perdidos
+STATUS_INTERVAL_S = 1.0        # regrava o status.json no máximo a cada N s (ou quando muda)
+
+# --- FECHAMENTO DE VOLTA (lap_closure.py) ---
+LAP_SETTLE_S = 0.5             # CarIdxLap/posição sem mudar por N s → volta fechada...
+LAP_CLOSE_MIN_S = 0.5          # ...mas nunca antes de N s após a detecção...
+LAP_CLOSE_MAX_S = 3.0          # ...e no máximo N s após a detecção
@@ -0,0 +1,81 @@
+import time
+from config import LAP_SETTLE_S, LAP_CLOSE_MIN_S, LAP_CLOSE_MAX_S
+
+# ==============================
+# Fechamento de volta sem bloquear o loop
+# ==============================
+# Antes, ao mudar LapLastLapTime, o leitor dormia 0,8–1,5 s para "consolidar"
+# CarIdxLap, posição e combustível, e nesse intervalo não atualizava status,
+# heartbeat nem combustível. Agora a volta fica pendente e o loop continua
+# amostrando a cada tick:
+#
+#   ociosa ── LapLastLapTime mudou ──▶ pendente ── estável / prazo ──▶ fechada
+#
+# A volta pendente fecha quando CarIdxLap e posição ficam sem mudar por
+# LAP_SETTLE_S (depois de pelo menos LAP_CLOSE_MIN_S) ou quando passam
+# LAP_CLOSE_MAX_S. Durante a espera guarda o maior combustível visto, para a
+# detecção de reabastecimento não depender de uma única leitura.
+#
+# `sample` é um dict do tick atual com, no mínimo, car_lap, pos_g, pos_c e fuel.
+
+
+class ClosedLap:
+    __slots__ = ('lap_time', 'wall_time', 'fuel_at_trigger', 'fuel_max', 'sample', 'waited_s')
+
+    def __init__(self, pending, now):
+        self.lap_time = pending.lap_time
+        self.wall_time = pending.wall_time          # epoch do tick em que a volta foi detectada
+        self.fuel_at_trigger = pending.fuel_at_trigger
+        self.fuel_max = pending.fuel_max
+        self.sample = pending.sample                # último tick antes de fechar
+        self.waited_s = now - pending.started
+
+
+class _Pending:
+    __slots__ = ('lap_time', 'wall_time', 'started', 'changed_at', 'fuel_at_trigger', 'fuel_max', 'sample')
+
+    def __init__(self, lap_time, now, sample):
+        self.lap_time = lap_time
+        self.wall_time = time.time()
+        self.started = self.changed_at = now
+        self.fuel_at_trigger = self.fuel_max = sample['fuel']
+        self.sample = sample
+
+
+class LapClosure:
+    def __init__(self, settle_s=LAP_SETTLE_S, min_s=LAP_CLOSE_MIN_S, max_s=LAP_CLOSE_MAX_S):
+        self._settle_s = settle_s
+        self._min_s = min_s
+        self._max_s = max_s
+        self._pending = None
+        self.last_lap_time = -1.0
+
+    @property
+    def pending(self):
+        return self._pending is not None
+
+    def reset(self):
+        """Nova sessão: descarta a volta pendente e esquece o último tempo visto."""
+        self._pending = None
+        self.last_lap_time = -1.0
+
+    def step(self, now, lap_last_time, sample, allow_trigger=True):
+        """Chamado a cada tick (now = time.monotonic()). Devolve a ClosedLap que
+        fechou neste tick, ou None."""
+        closed = None
+        pending = self._pending
+        if pending is not None:
+            if (sample['car_lap'], sample['pos_g']) != (pending.sample['car_lap'], pending.sample['pos_g']):
+                pending.changed_at = now
+            pending.sample = sample
+            pending.fuel_max = max(pending.fuel_max, sample['fuel'])
+            settled = now - pending.started >= self._min_s and now - pending.changed_at >= self._settle_s
+            if settled or now - pending.started >= self._max_s:
+                closed, self._pending = ClosedLap(pending, now), None
+
+        if allow_trigger and lap_last_time > 0 and lap_last_time != self.last_lap_time:
+            if self._pending is not None:   # nova volta antes de a anterior assentar
+                closed = ClosedLap(self._pending, now)
+            self._pending = _Pending(lap_last_time, now, sample)
+            self.last_lap_time = lap_last_time
+        return closed
@@ -3,7 +3,9 @@ import time
 import pandas as pd
 import json
 from collections import deque
-from config import LOG_DIR, WINDOW_SIZE
+from config import LOG_DIR, WINDOW_SIZE, STATUS_INTERVAL_S
+from lap_closure import LapClosure
+from sampler import SdkSampler
 
 # ==============================
 # Configuração
@@ -18,7 +20,13 @@ ir = irsdk.IRSDK()
 # Funções auxiliares
 # ==============================
 
+last_status = (None, 0.0)   # (estado gravado, quando)
+
 def update_status(state, driver="---", track="---"):
+    global last_status
+    # Chamado a cada tick (até 60 Hz): só regrava quando muda ou a cada STATUS_INTERVAL_S.
+    if last_status[0] == (state, driver, track) and time.time() - last_status[1] < STATUS_INTERVAL_S:
+        return
     status_data = {
         "state": state,
         "driver": driver,
@@ -27,6 +35,7 @@ def update_status(state, driver="---", track="---"):
     }
     with open(STATUS_PATH, "w") as f:
         json.dump(status_data, f)
+    last_status = ((state, driver, track), status_data["last_update"])
 
 def get_session_type(session_num):
     try:
@@ -41,12 +50,11 @@ def get_session_type(session_num):
 last_valid_pos_g = 0
 last_valid_pos_c = 0
 
-def get_valid_position():
+def get_valid_position(tick, idx):
     global last_valid_pos_g, last_valid_pos_c
     try:
-        idx = ir['DriverInfo']['DriverCarIdx']
-        pos_g = ir['CarIdxPosition'][idx]
-        pos_c = ir['CarIdxClassPosition'][idx]
+        pos_g = tick['CarIdxPosition'][idx]
+        pos_c = tick['CarIdxClassPosition'][idx]
 
         if pos_g > 0:
             last_valid_pos_g = int(pos_g)
@@ -61,7 +69,7 @@ def get_valid_position():
 # ==============================
 
 last_session_num = -1
-last_recorded_lap_time = -1.0
+lap_closure = LapClosure()   # detecta e fecha a volta sem pausar o loop
 fuel_at_lap_start = -1.0
 file_initialized = False
 grid_recorded = False
@@ -69,6 +77,12 @@ grid_recorded = False
 laps_window = deque(maxlen=WINDOW_SIZE)
 fuel_window = deque(maxlen=WINDOW_SIZE)
 
+# Variáveis lidas a cada tick, todas do mesmo frame (sampler.py)
+sampler = SdkSampler(ir, [
+    'FuelLevel', 'CarIdxLap', 'CarIdxPosition', 'CarIdxClassPosition', 'SessionNum',
+    'SessionState', 'LapLastLapTime', 'SessionLapsRemain', 'SessionTimeRemain',
+])
+
 print("📡 Telemetria Dinâmica Ativa - Estratégia de Equipe (CarIdx)")
 
 try:
@@ -78,12 +92,15 @@ try:
             ir.startup()
             update_status("offline")
             file_initialized = False
+            sampler.reset()
             time.sleep(1)
             continue
 
+        # Espera o próximo frame do iRacing e lê as variáveis de uma vez
+        tick = sampler.tick()
+
         car_idx = ir['DriverInfo']['DriverCarIdx']
         if car_idx < 0:
-            time.sleep(0.2)
             continue
 
         # ===== DADOS DO PILOTO E SESSÃO =====
@@ -96,22 +113,22 @@ try:
             current_driver, current_user_id, team_name = "Unknown", -1, "N/A"
 
         # ===== Sessão =====
-        session_num = ir['SessionNum']
+        session_num = tick['SessionNum']
         session_name = get_session_type(session_num)
 
         if session_num != last_session_num:
             laps_window.clear()
             fuel_window.clear()
             grid_recorded = False
-            last_recorded_lap_time = -1.0
+            lap_closure.reset()
             last_session_num = session_num
             print(f"🔄 Nova Sessão: {session_name}")
 
         track_name = ir['WeekendInfo']['TrackDisplayName']
         update_status("cockpit", current_driver, track_name)
 
-        fuel_now = ir['FuelLevel']
-        pos_g, pos_c = get_valid_position()
+        fuel_now = tick['FuelLevel']
+        pos_g, pos_c = get_valid_position(tick, car_idx)
 
         # ===== Inicializa CSV (Adicionado coluna 'Volta') =====
         if not file_initialized:
@@ -125,35 +142,40 @@ try:
             file_initialized = True
 
         # ===== GRID =====
-        if (not grid_recorded and ir['SessionState'] == 4 and fuel_now > 0.5):
+        if (not grid_recorded and tick['SessionState'] == 4 and fuel_now > 0.5):
             fuel_at_lap_start = fuel_now
             grid_recorded = True
             print(f"🟢 [GRID] {current_driver} alinhado.")
 
         # ===== DETECÇÃO DE VOLTA (LapLastLapTime Trigger) =====
-        lap_last_time = ir['LapLastLapTime']
-
-        if lap_last_time > 0 and lap_last_time != last_recorded_lap_time:
-
-            time.sleep(0.8)  # Consolidação leve
+        # A volta fica pendente até CarIdxLap/posição assentarem (lap_closure.py),
+        # sem pausar o loop.
+        sample = {
+            "car_lap": tick['CarIdxLap'][car_idx],
+            "pos_g":   pos_g,
+            "pos_c":   pos_c,
+            "fuel":    fuel_now,
+        }
+        closed = lap_closure.step(time.monotonic(), tick['LapLastLapTime'], sample)
+
+        if closed is not None:
+            lap_last_time = closed.lap_time
 
             # --- ESTRATÉGIA DE EQUIPE: CONTAGEM GLOBAL ---
             # CarIdxLap pega a volta do carro no servidor, independente de quem pilota
-            current_car_lap = ir['CarIdxLap'][car_idx]-1.0  # Ajuste para refletir a volta completa anterior, já que o iRacing atualiza no início da nova volta
+            current_car_lap = closed.sample["car_lap"]-1.0  # Ajuste para refletir a volta completa anterior, já que o iRacing atualiza no início da nova volta
 
-            # Revalida dados após consolidação
-            driver_data = ir['DriverInfo']['Drivers'][car_idx]
-            current_driver = driver_data.get('UserName', 'Unknown')
-            fuel_now = ir['FuelLevel']
-            pos_g, pos_c = get_valid_position()
+            # Dados do último tick antes de fechar a volta
+            fuel_now = closed.sample["fuel"]
+            pos_g, pos_c = closed.sample["pos_g"], closed.sample["pos_c"]
 
             # Tempo médio das últimas voltas
             laps_window.append(lap_last_time)
             avg_lap_time = sum(laps_window) / len(laps_window)
 
             # Voltas Estimadas (Mantido sua lógica original)
-            session_laps_remain = ir['SessionLapsRemain']
-            session_time_remain = ir['SessionTimeRemain']
+            session_laps_remain = tick['SessionLapsRemain']
+            session_time_remain = tick['SessionTimeRemain']
             if session_laps_remain > 0 and session_laps_remain < 10000:
                 voltas_estimadas = session_laps_remain
             elif avg_lap_time > 0 and session_time_remain > 0:
@@ -173,7 +195,7 @@ try:
             avg_fuel = sum(fuel_window) / len(fuel_window) if fuel_window else consumo
 
             data = {
-                "Timestamp": time.strftime("%H:%M:%S"),
+                "Timestamp": time.strftime("%H:%M:%S", time.localtime(closed.wall_time)),
                 "Sessao": session_name, "Pista": track_name,
                 "Equipe": team_name, "Piloto": current_driver,
                 "UserID": current_user_id, "Volta": current_car_lap,  # Volta completa é a anterior
@@ -189,11 +211,8 @@ try:
 
             pd.DataFrame([data]).to_csv(CSV_PATH, mode='a', index=False, header=False)
 
-            last_recorded_lap_time = lap_last_time
             fuel_at_lap_start = fuel_now
 
-        time.sleep(0.2)
-
 except KeyboardInterrupt:
     update_status("offline")
 finally: